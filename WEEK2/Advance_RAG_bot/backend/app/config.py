@@ -21,16 +21,85 @@ class Settings(BaseSettings):
     @property
     def AVAILABLE_LLMS(self) -> List[str]:
         all_models = []
-        if self.GEMINI_API_KEY:
+        if self.GEMINI_API_KEY or self.MOCK_PROVIDERS:
             all_models.extend([f"gemini:{model}" for model in self.GEMINI_MODELS])
-        if self.GROQ_API_KEY:
+        if self.GROQ_API_KEY or self.MOCK_PROVIDERS:
             all_models.extend([f"groq:{model}" for model in self.GROQ_MODELS])
-        if self.COHERE_API_KEY:
+        if self.COHERE_API_KEY or self.MOCK_PROVIDERS:
             all_models.extend([f"cohere:{model}" for model in self.COHERE_MODELS])
         return all_models
     
+    # Provider rate limiting, keyed by "provider:model", "provider" or "default"
+    # rate = requests per second, burst = bucket size, max_concurrency = simultaneous calls
+    LLM_RATE_LIMITS: Dict[str, Dict[str, float]] = {
+        "default": {"rate": 1.0, "burst": 5, "max_concurrency": 4},
+        "gemini": {"rate": 0.25, "burst": 5, "max_concurrency": 4},
+        "groq": {"rate": 0.5, "burst": 5, "max_concurrency": 4},
+        "cohere": {"rate": 0.33, "burst": 5, "max_concurrency": 4}
+    }
+    LLM_QUEUE_TIMEOUT: float = 30.0  # seconds a request may wait for a provider slot
+    LLM_MAX_RETRIES: int = 2  # retries of a call the provider rejected with 429
+    LLM_RETRY_BASE_DELAY: float = 1.0  # seconds before the first retry, doubled each time unless Retry-After says otherwise
+    LLM_RETRY_MAX_DELAY: float = 10.0
+    LLM_WARMUP_ON_STARTUP: bool = True  # open provider connections when the server starts
+    
+    # Mock providers: in-process fakes for Gemini, Groq, Cohere and Serper for offline load testing
+    MOCK_PROVIDERS: bool = False
+    MOCK_LATENCY_DISTRIBUTION: str = "lognormal"  # fixed, uniform, normal or lognormal
+    MOCK_LATENCY_MS: float = 300.0  # mean time to first token
+    MOCK_LATENCY_JITTER_MS: float = 100.0  # spread (standard deviation, or half-range for uniform)
+    MOCK_SEARCH_LATENCY_MS: float = 400.0
+    MOCK_TOKENS_PER_SECOND: float = 200.0
+    MOCK_RESPONSE_TOKENS: int = 150
+    MOCK_ERROR_RATE: float = 0.0  # fraction of calls that fail
+    MOCK_ERROR_STATUS: int = 429
+    MOCK_SEED: Optional[int] = 42
+    
+    # Token accounting: optional USD prices per 1M tokens, keyed by "provider:model" or "provider"
+    # e.g. {"groq": {"prompt": 0.05, "completion": 0.08}}
+    LLM_TOKEN_PRICES: Dict[str, Dict[str, float]] = {}
+    TOKEN_USAGE_MAX_SESSIONS: int = 10000
+    
+    # Map-reduce answering for very large document context
+    MAP_REDUCE_ENABLED: bool = True
+    MAP_REDUCE_THRESHOLD_CHARS: int = 100_000  # total document characters that trigger map-reduce
+    MAP_REDUCE_CHUNK_CHARS: int = 24_000
+    MAP_REDUCE_CHUNK_OVERLAP: int = 500
+    MAP_REDUCE_MAX_CONCURRENCY: int = 4  # chunks in flight per request
+    
+    # Internet search (Serper) client and result cache
+    SEARCH_TIMEOUT: float = 10.0
+    SEARCH_MAX_CONNECTIONS: int = 20
+    SEARCH_CACHE_TTL: float = 600.0  # seconds a cached result is fresh
+    SEARCH_CACHE_STALE_TTL: float = 3600.0  # extra seconds a popular result is served while refreshing
+    SEARCH_CACHE_POPULAR_HITS: int = 2  # cache hits before a query counts as popular
+    SEARCH_CACHE_MAX_ENTRIES: int = 1000
+    
     # RAG Configurations
     RAG_VARIANTS: List[str] = ["basic", "knowledge_graph", "hybrid"]
+    HYBRID_SEARCH_DEADLINE: float = 3.0  # seconds hybrid search waits for internet results
+    HYBRID_MIN_SCORE: float = 0.2  # minimum query cosine similarity for a hybrid source to be kept
+    HYBRID_EMBEDDING_CACHE_SIZE: int = 2000  # cached web result embeddings
+    EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"  # one encoder shared by retrieval and the relevance gate
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1000
+    QUERY_EMBEDDING_CACHE_TTL: float = 600.0
+    
+    # Conversation memory: per-worker LRU of recent sessions over a shared SQLite (WAL) log
+    SESSION_STORE: str = "sqlite"  # "memory" keeps sessions in this worker only
+    SESSION_DB_PATH: str = "./data/sessions.db"
+    SESSION_MAX_SESSIONS: int = 10000  # sessions cached in memory per worker
+    SESSION_IDLE_TTL: float = 3600.0  # seconds before an idle session leaves memory
+    SESSION_DB_RETENTION_DAYS: int = 30  # sessions idle this long are pruned from SQLite at startup; 0 keeps all
+    MEMORY_RECENT_MESSAGES: int = 5  # newest messages sent verbatim; older ones reach the prompt via the summary
+    MEMORY_SUMMARY_ENABLED: bool = True  # roll older turns into an LLM-written summary in the background
+    MEMORY_SUMMARY_LLM: Optional[str] = None  # "provider:model" used for summaries; defaults to the selected LLM
+    MEMORY_SUMMARY_TRIGGER_TOKENS: int = 400  # unsummarized tokens outside the recent messages that trigger a summary
+    MEMORY_SUMMARY_MAX_WORDS: int = 150
+    MEMORY_RECALL_ENABLED: bool = True  # embed every question-and-answer pair and recall the earlier ones most similar to the question
+    MEMORY_RECALL_TOP_K: int = 3
+    MEMORY_RECALL_MIN_SIMILARITY: float = 0.35  # cosine similarity an earlier turn needs to be recalled
+    MEMORY_RECALL_TOKEN_BUDGET: int = 600  # tokens of recalled turns added to the prompt
+    MEMORY_RECALL_MAX_TURNS: int = 200  # embedded turns kept per session; the oldest are dropped first
     
     # Vector Store
     VECTOR_STORE_PATH: str = "./data/vector_store"
@@ -39,8 +108,44 @@ class Settings(BaseSettings):
     SUPPORTED_FILE_TYPES: List[str] = [".pdf", ".txt", ".docx", ".doc", ".png", ".jpg", ".jpeg", ".pptx", ".xlsx"]
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
     
+    # Chat image pre-processing: longest side sent to each provider, re-encode quality, cache
+    IMAGE_MAX_DIMENSION: Dict[str, int] = {"gemini": 1536, "cohere": 1568, "default": 1536}
+    IMAGE_JPEG_QUALITY: int = 85
+    IMAGE_CACHE_SIZE: int = 256
+    IMAGE_CACHE_TTL: float = 3600.0
+    
     # Security
-    GUARDRAIL_MODEL: str = "microsoft/DialoGPT-medium"
+    GUARDRAIL_MODEL: str = "michellejieli/NSFW_text_classifier"  # lightweight NSFW text classifier
+    TOXICITY_MODEL: str = "unitary/toxic-bert"
+    TOXICITY_BACKEND: str = "pytorch"  # "onnx" runs toxic-bert on ONNX Runtime (needs optimum[onnxruntime])
+    ONNX_MODEL_DIR: str = "./data/onnx"  # exported and quantized models are cached here
+    ONNX_QUANTIZE: bool = True  # dynamic int8 quantization of the exported model
+    ONNX_QUANTIZATION_TARGET: str = "auto"  # avx2, avx512, avx512_vnni or arm64; auto picks by CPU architecture
+    ONNX_INTRA_OP_THREADS: int = 0  # threads per inference, 0 lets ONNX Runtime decide
+    ONNX_INTER_OP_THREADS: int = 1
+    GUARDRAIL_WARMUP_ON_STARTUP: bool = True  # load guardrail models in the background after startup
+    GUARDRAIL_BATCH_MAX_SIZE: int = 16  # messages per classifier batch
+    GUARDRAIL_BATCH_MAX_WAIT_MS: float = 5.0  # how long a batch waits for more concurrent messages
+    GUARDRAIL_EXECUTOR_WORKERS: int = 32  # threads reserved for guardrail checks; keep above GUARDRAIL_BATCH_MAX_SIZE
+    TOXICITY_THRESHOLD: float = 0.6
+    NSFW_THRESHOLD: float = 0.7
+    GUARDRAIL_WINDOW_OVERLAP: int = 64  # tokens shared by neighbouring windows
+    GUARDRAIL_WINDOW_BATCH: int = 8  # windows per forward pass; scanning stops at the first flagged batch
+    RELEVANCE_THRESHOLD: float = 0.2  # minimum question cosine similarity to a document's centroid or best chunk
+    RELEVANCE_CHUNK_CHARS: int = 1000  # document chunk size embedded at upload for the relevance gate
+    RELEVANCE_MAX_CHUNKS: int = 128  # chunks embedded per document; larger documents are sampled evenly
+    GUARDRAIL_CACHE_SIZE: int = 5000  # cached verdicts for repeated messages
+    GUARDRAIL_CACHE_TTL: float = 900.0
+    # Guardrail stages, cheapest first; a stage that rejects or accepts skips the rest
+    GUARDRAIL_PIPELINE: List[str] = ["keywords", "cache", "relevance", "nsfw_model", "toxicity"]
+    GUARDRAIL_SAFE_PATTERNS: List[str] = [
+        r"(hi|hello|hey|good (morning|afternoon|evening))( there)?[.!]*",
+        r"(thanks|thank you|thx|ok|okay|got it|great|cool|bye|goodbye)[.!]*"
+    ]
+    GUARDRAIL_SAFE_MAX_CHARS: int = 40  # only messages this short can be accepted by a safe pattern
+    OUTPUT_MODERATION_ENABLED: bool = True  # score streamed answers and cut them off when flagged
+    OUTPUT_MODERATION_MIN_WINDOW_CHARS: int = 80  # sentences are merged until a window is at least this long
+    OUTPUT_MODERATION_MAX_WINDOW_CHARS: int = 500  # windows without a sentence end are split here
     
     class Config:
         # Build an absolute path to the .env file which is two directories up from this config file.
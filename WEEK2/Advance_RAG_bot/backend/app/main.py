@@ -1,10 +1,13 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from contextlib import asynccontextmanager
 import uvicorn
+import asyncio
 import base64
 import json
-from typing import List, Optional
+from typing import List, Optional, Dict, Any, Callable
 import logging
 import traceback
 
@@ -30,8 +33,10 @@ except ImportError:
 
 from models.models import ChatMessage, ChatResponse, ConfigUpdate, RAGVariant, UploadResponse, DocumentInfo, LLMProvider, DocumentType, MemoryMessage
 from services.llm_service import LLMService, InternetSearchService
+from services.rate_limiter import ProviderBusyError, ProviderError
 from services.rag_service import RAGFactory
 from services.guardrails import EnhancedGuardrailsService
+from services.output_moderation import OutputModerator, OutputBlockedError
 from services.memory import ConversationMemory
 from services.document_processor import DocumentProcessor
 from config import settings
@@ -73,9 +78,19 @@ setup_observability()
 llm_service = LLMService()
 search_service = InternetSearchService()
 guardrails = EnhancedGuardrailsService()
-memory = ConversationMemory()
+output_moderator = OutputModerator(guardrails)
 document_processor = DocumentProcessor()
 
+async def summarize_conversation(previous_summary: Optional[str], messages: List[Dict[str, Any]], session_id: str) -> Optional[str]:
+    """Rolling conversation summary for memory, written by the configured summary LLM"""
+    llm_choice = settings.MEMORY_SUMMARY_LLM or current_config.selected_llm
+    return await llm_service.summarize_conversation(llm_choice, previous_summary, messages, session_id)
+
+memory = ConversationMemory(
+    document_resolver=document_processor.resolve_document_ref,
+    summarizer=summarize_conversation if settings.MEMORY_SUMMARY_ENABLED else None
+)
+
 # Global configuration
 current_config = ConfigUpdate(
     selected_llm=settings.AVAILABLE_LLMS[0] if settings.AVAILABLE_LLMS else "gemini:gemini-2.0-flash",
@@ -86,7 +101,23 @@ current_config = ConfigUpdate(
 
 rag_service = RAGFactory.create_rag(current_config.selected_rag_variant, search_service)
 
-app = FastAPI(title="Enhanced Multi-modal RAG Chatbot", version="2.0.0")
+# Background tasks started with the server (kept referenced so they are not garbage collected)
+startup_tasks: List[asyncio.Task] = []
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Kick off background warm-up without delaying server startup"""
+    if settings.LLM_WARMUP_ON_STARTUP:
+        startup_tasks.append(asyncio.create_task(llm_service.warm_up()))
+    if settings.GUARDRAIL_WARMUP_ON_STARTUP:
+        startup_tasks.append(asyncio.create_task(guardrails.run(guardrails.warm_up)))
+    yield
+    for task in startup_tasks:
+        task.cancel()
+    await search_service.aclose()
+    guardrails.executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="Enhanced Multi-modal RAG Chatbot", version="2.0.0", lifespan=lifespan)
 
 # Instrument FastAPI with OpenTelemetry (if available)
 if OPENTELEMETRY_AVAILABLE:
@@ -122,6 +153,62 @@ async def health_check():
         "llm_available": bool(settings.GEMINI_API_KEY or settings.GROQ_API_KEY or settings.COHERE_API_KEY)
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 200 once guardrail models are loaded, 503 while they are warming"""
+    readiness = guardrails.get_readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+@app.get("/metrics/guardrails")
+async def get_guardrail_stats():
+    """Guardrail model state, inference batching, verdict cache and per-stage statistics"""
+    return {
+        "models": guardrails.get_readiness()["models"],
+        "batching": guardrails.get_batching_stats(),
+        "encoder": guardrails.encoder.get_stats(),
+        "verdict_cache": guardrails.get_cache_stats(),
+        "pipeline": guardrails.get_pipeline_stats(),
+        "output_moderation": output_moderator.get_stats()
+    }
+
+@app.get("/metrics/sessions")
+async def get_session_stats():
+    """Conversation memory session cache, store and summarizer statistics"""
+    return {**memory.store.get_stats(), "summarizer": memory.get_summary_stats(), "recall": memory.get_recall_stats()}
+
+@app.get("/metrics/single-flight")
+async def get_single_flight_stats():
+    """Coalescing statistics for outbound LLM and search calls"""
+    return {
+        "llm": llm_service.single_flight.get_stats(),
+        "search": search_service.single_flight.get_stats()
+    }
+
+@app.get("/metrics/search-cache")
+async def get_search_cache_stats():
+    """Hit rates of the internet search result cache"""
+    return search_service.cache.get_stats()
+
+@app.get("/metrics/images")
+async def get_image_stats():
+    """Upload bytes saved by chat image pre-processing"""
+    return llm_service.image_processor.get_stats()
+
+@app.get("/metrics/rate-limits")
+async def get_rate_limit_stats():
+    """Queue depth and wait-time statistics per provider/model"""
+    return {"limiters": llm_service.rate_limiter.get_stats()}
+
+@app.get("/metrics/tokens")
+async def get_token_usage():
+    """Prompt and completion token usage aggregated per model and endpoint"""
+    return llm_service.token_usage.get_stats()
+
+@app.get("/metrics/tokens/{session_id}")
+async def get_session_token_usage(session_id: str):
+    """Prompt and completion token usage for one session"""
+    return {"session_id": session_id, "usage": llm_service.token_usage.get_session_stats(session_id)}
+
 @app.get("/config/llms")
 async def get_available_llms():
     return {"llms": settings.AVAILABLE_LLMS}
@@ -203,23 +290,117 @@ async def delete_document(document_id: str):
 
 @app.post("/chat")
 async def chat(chat_message: ChatMessage):
+    return await process_chat(chat_message)
+
+@app.post("/chat/stream")
+async def chat_stream(chat_message: ChatMessage):
+    """Chat with progress and answer tokens streamed as newline-delimited JSON events, ending with a result or error event"""
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def run_chat():
+        try:
+            result = await process_chat(
+                chat_message,
+                progress_callback=lambda event: events.put_nowait({"event": "progress", **event}),
+                token_callback=lambda text: events.put_nowait({"event": "token", "text": text})
+            )
+            if isinstance(result, JSONResponse):
+                events.put_nowait({"event": "result", "status_code": result.status_code, "data": json.loads(result.body)})
+            else:
+                events.put_nowait({"event": "result", "status_code": 200, "data": jsonable_encoder(result)})
+        except HTTPException as e:
+            events.put_nowait({"event": "error", "status_code": e.status_code, "detail": e.detail})
+    
+    async def event_stream():
+        task = asyncio.create_task(run_chat())
+        try:
+            while True:
+                event = await events.get()
+                yield json.dumps(event) + "\n"
+                if event["event"] not in ("progress", "token"):
+                    break
+        finally:
+            # Stop the work if the client disconnects early
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+async def retrieve_context(message: str) -> List[Dict[str, Any]]:
+    """Run RAG retrieval for a chat message; failures fall back to no results"""
+    if not (current_config.selected_documents or current_config.enable_internet_search):
+        return []
+    try:
+        if current_config.selected_rag_variant == "hybrid":
+            rag_results = await rag_service.search(message)
+        else:
+            # Query encoding and FAISS search are blocking
+            rag_results = await asyncio.to_thread(rag_service.search, message)
+        logger.info(f"RAG search returned {len(rag_results)} results")
+        return rag_results
+    except Exception as e:
+        logger.warning(f"RAG search failed: {str(e)}")
+        return []
+
+async def process_chat(
+    chat_message: ChatMessage,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    token_callback: Optional[Callable[[str], None]] = None
+):
+    """Run the chat pipeline shared by /chat and /chat/stream; with token_callback the answer is streamed"""
     try:
         logger.info(f"Chat request received: {chat_message.message[:100]}...")
         
         # Get document context if documents are selected
         document_context = []
+        document_refs = []
+        topic_profiles = []
+        document_vectors = []
+        document_set_version = None
         if chat_message.document_ids:
             document_context = document_processor.get_document_content(chat_message.document_ids)
+            document_refs = document_processor.get_document_refs(chat_message.document_ids)
+            topic_profiles = document_processor.get_topic_profiles(chat_message.document_ids)
+            document_vectors = document_processor.get_relevance_vectors(chat_message.document_ids)
+            document_set_version = document_processor.get_document_set_version(chat_message.document_ids)
             logger.info(f"Using {len(document_context)} document contexts")
         
-        # Enhanced validation with document relevance
-        safety_check = guardrails.validate_request(
+        # Safety check, conversation history and retrieval don't depend on each other, so they run
+        # together. Retrieval is speculative and gets discarded if the request is rejected.
+        retrieval_task = asyncio.create_task(retrieve_context(chat_message.message))
+        previous_question = None
+        if document_vectors:
+            # The relevance gate reads follow-ups together with the question before them
+            try:
+                previous_question = await asyncio.to_thread(memory.get_last_question, chat_message.session_id)
+            except BaseException:
+                retrieval_task.cancel()
+                raise
+        safety_task = asyncio.create_task(guardrails.run(
+            guardrails.validate_request,
             chat_message.message, 
             chat_message.images, 
-            document_context
-        )
+            document_context,
+            topic_profiles,
+            document_vectors,
+            document_set_version,
+            previous_question
+        ))
+        try:
+            # Summary, recalled and recent turns from memory; sent to the LLM with the current question
+            # Recall shares the question's embedding with retrieval and the relevance gate
+            context = await asyncio.to_thread(
+                memory.get_context_string, chat_message.session_id, None, chat_message.message
+            )
+            logger.info(f"Conversation context length: {len(context)} characters")
+            safety_check = await safety_task
+        except BaseException:
+            safety_task.cancel()
+            retrieval_task.cancel()
+            raise
         
         if not safety_check["safe"]:
+            retrieval_task.cancel()
             logger.warning(f"Request rejected: {safety_check['rejection_reason']}")
             return JSONResponse(
                 status_code=400,
@@ -232,49 +413,69 @@ async def chat(chat_message: ChatMessage):
                 }
             )
         
-        # Add user message to memory with document context
-        memory.add_message(
+        # Add user message to memory with references to the selected documents
+        await memory.add_message_async(
             session_id=chat_message.session_id,
             role="user", 
             content=chat_message.message,
-            document_context=document_context
+            document_refs=document_refs
         )
         
-        # Get conversation context
-        context = memory.get_context_string(chat_message.session_id)
-        logger.info(f"Conversation context length: {len(context)} characters")
-        
-        # Perform RAG search
-        rag_results = []
-        if current_config.selected_documents or current_config.enable_internet_search:
-            try:
-                if current_config.selected_rag_variant == "hybrid":
-                    rag_results = await rag_service.search(chat_message.message)
-                else:
-                    rag_results = rag_service.search(chat_message.message)
-                logger.info(f"RAG search returned {len(rag_results)} results")
-            except Exception as e:
-                logger.warning(f"RAG search failed: {str(e)}")
-                rag_results = []
+        rag_results = await retrieval_task
         
         # Prepare context for LLM
         context_text = "\n".join([result.get("content", "") for result in rag_results]) if rag_results else ""
         
         # Generate response
-        llm_response = await llm_service.generate_response(
-            current_config.selected_llm,
-            chat_message.message,
-            chat_message.images,
-            context_text,
-            document_context
-        )
+        output_blocked = None
+        if token_callback is not None:
+            # Stream the answer through output moderation, which only releases verified text
+            llm_response = {}
+            parts = []
+            stream = llm_service.stream_response(
+                current_config.selected_llm,
+                chat_message.message,
+                chat_message.images,
+                context_text,
+                document_context,
+                session_id=chat_message.session_id,
+                endpoint="chat",
+                usage=llm_response,
+                conversation=context,
+                document_set_version=document_set_version,
+                progress_callback=progress_callback
+            )
+            try:
+                async for text in output_moderator.moderate(stream):
+                    parts.append(text)
+                    token_callback(text)
+                output_blocked = False
+                llm_response["content"] = "".join(parts)
+            except OutputBlockedError as e:
+                output_blocked = True
+                if progress_callback is not None:
+                    progress_callback({"stage": "moderation", "action": "blocked", "reason": e.reason})
+                llm_response["content"] = "".join(parts).rstrip() + "\n\n[Response stopped by output moderation]"
+        else:
+            llm_response = await llm_service.generate_response(
+                current_config.selected_llm,
+                chat_message.message,
+                chat_message.images,
+                context_text,
+                document_context,
+                session_id=chat_message.session_id,
+                endpoint="chat",
+                progress_callback=progress_callback,
+                conversation=context,
+                document_set_version=document_set_version
+            )
         
         # Add assistant response to memory
-        memory.add_message(
+        await memory.add_message_async(
             session_id=chat_message.session_id,
             role="assistant", 
             content=llm_response["content"],
-            document_context=document_context
+            document_refs=document_refs
         )
         
         logger.info(f"Chat response generated successfully. Tokens used: {llm_response.get('tokens_used', 0)}")
@@ -284,9 +485,28 @@ async def chat(chat_message: ChatMessage):
             sources=rag_results,
             session_id=chat_message.session_id,
             tokens_used=llm_response.get("tokens_used", 0),
-            is_relevant=True
+            prompt_tokens=llm_response.get("prompt_tokens"),
+            completion_tokens=llm_response.get("completion_tokens"),
+            is_relevant=True,
+            output_blocked=output_blocked
         )
         
+    except ProviderBusyError as e:
+        logger.warning(f"Chat request timed out waiting for LLM provider: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(int(settings.LLM_QUEUE_TIMEOUT))}
+        )
+    except ProviderError as e:
+        logger.warning(f"LLM provider failed the chat request: {str(e)}")
+        if e.rate_limited:
+            raise HTTPException(
+                status_code=503,
+                detail=str(e),
+                headers={"Retry-After": str(int(e.retry_after or settings.LLM_RETRY_MAX_DELAY))}
+            )
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         logger.error(traceback.format_exc())
@@ -294,12 +514,12 @@ async def chat(chat_message: ChatMessage):
 
 @app.get("/memory/{session_id}")
 async def get_conversation_memory(session_id: str):
-    history = memory.get_conversation_history(session_id)
+    history = await asyncio.to_thread(memory.get_conversation_history, session_id)
     return {"session_id": session_id, "history": history}
 
 @app.delete("/memory/{session_id}")
 async def clear_memory(session_id: str):
-    memory.clear_memory(session_id)
+    await asyncio.to_thread(memory.clear_memory, session_id)
     return {"status": "memory cleared"}
 
 if __name__ == "__main__":
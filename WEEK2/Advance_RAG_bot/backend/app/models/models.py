@@ -20,6 +20,11 @@ class DocumentType(str, Enum):
     PPTX = "pptx"
     XLSX = "xlsx"
 
+class TopicProfile(BaseModel):
+    categories: List[str] = []
+    keyword_counts: Dict[str, int] = {}
+    centroid: Optional[List[float]] = Field(default=None, exclude=True)  # mean chunk embedding, kept out of API responses
+
 class DocumentInfo(BaseModel):
     id: str
     name: str
@@ -27,6 +32,7 @@ class DocumentInfo(BaseModel):
     upload_time: str
     size: int
     content_summary: Optional[str] = None
+    topic_profile: Optional[TopicProfile] = None
 
 class ChatMessage(BaseModel):
     message: str
@@ -39,8 +45,11 @@ class ChatResponse(BaseModel):
     sources: Optional[List[Dict[str, Any]]] = None
     session_id: str
     tokens_used: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
     is_relevant: bool = True
     rejection_reason: Optional[str] = None
+    output_blocked: Optional[bool] = None  # streamed answer was cut off by output moderation
 
 class ConfigUpdate(BaseModel):
     selected_llm: str
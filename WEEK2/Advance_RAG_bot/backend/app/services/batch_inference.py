@@ -0,0 +1,90 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingClassifier:
+    """Gather inputs from concurrent callers and run them through a classifier as one padded batch.
+
+    A single worker thread takes the first waiting input, keeps collecting for up to
+    `max_wait_ms` or until `max_batch_size` inputs are queued, then runs one batch.
+    Callers block only on their own result.
+    """
+
+    def __init__(self, name: str, classify_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.name = name
+        self.classify_batch = classify_batch
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max(max_wait_ms, 0.0) / 1000
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.total_batch_seconds = 0.0
+
+    def submit(self, item: Any) -> Future:
+        """Queue one input and return a future for its result"""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def classify(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Classify one input, blocking until its batch has run"""
+        return self.submit(item).result(timeout=timeout)
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                    self._worker.start()
+
+    def _collect_batch(self) -> List[Tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+            try:
+                results = self.classify_batch([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"[{self.name}] Batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.total_batch_seconds += time.monotonic() - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "avg_batch_ms": 1000 * self.total_batch_seconds / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize()
+        }
@@ -7,13 +7,24 @@ import pytesseract
 from PIL import Image
 import io
 import base64
+import asyncio
+import hashlib
+import logging
+import numpy as np
 from config import settings
-from models.models import DocumentInfo, DocumentType
+from models.models import DocumentInfo, DocumentType, TopicProfile
+from services.guardrails import DOCUMENT_CATEGORIES
+from services.keyword_matcher import KeywordMatcher
+from services.embeddings import get_encoder
 
 class DocumentProcessor:
     def __init__(self):
         self.uploaded_documents: Dict[str, DocumentInfo] = {}
         self.document_content: Dict[str, str] = {}
+        self.topic_matcher = KeywordMatcher(DOCUMENT_CATEGORIES)
+        # Normalized centroid (row 0) and chunk embeddings per document, for the relevance gate
+        self.relevance_vectors: Dict[str, np.ndarray] = {}
+        self.logger = logging.getLogger(__name__)
     
     async def process_uploaded_file(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """Process uploaded file and extract text content"""
@@ -36,6 +47,13 @@ class DocumentProcessor:
             else:
                 text_content = f"Unsupported file type: {file_ext}"
             
+            # Embed once at upload (off the event loop) so relevance checks need no document pass
+            relevance_vectors = await asyncio.to_thread(self._embed_document, text_content)
+            topic_profile = self._build_topic_profile(text_content)
+            if relevance_vectors is not None:
+                topic_profile.centroid = relevance_vectors[0].tolist()
+                self.relevance_vectors[document_id] = relevance_vectors
+            
             # Create document info
             doc_info = DocumentInfo(
                 id=document_id,
@@ -43,7 +61,8 @@ class DocumentProcessor:
                 type=doc_type,
                 upload_time=str(os.path.getctime(filename)) if os.path.exists(filename) else "unknown",
                 size=len(file_content),
-                content_summary=text_content[:200] + "..." if len(text_content) > 200 else text_content
+                content_summary=text_content[:200] + "..." if len(text_content) > 200 else text_content,
+                topic_profile=topic_profile
             )
             
             # Store document
@@ -115,6 +134,43 @@ class DocumentProcessor:
         except Exception as e:
             return f"Error extracting image text: {str(e)}"
     
+    def _build_topic_profile(self, text_content: str) -> TopicProfile:
+        """Scan a document once for the guardrail topic keywords"""
+        keyword_counts = self.topic_matcher.count_keywords(text_content)
+        return TopicProfile(
+            categories=self.topic_matcher.categories_for(keyword_counts),
+            keyword_counts=keyword_counts
+        )
+    
+    def _embed_document(self, text_content: str) -> Optional[np.ndarray]:
+        """Chunk embeddings for the relevance gate; a failure only disables the gate for this document"""
+        try:
+            return get_encoder().encode_document(text_content)
+        except Exception as e:
+            self.logger.warning(f"Failed to embed document for relevance checks: {e}")
+            return None
+    
+    def get_relevance_vectors(self, document_ids: List[str]) -> List[np.ndarray]:
+        """Get the upload-time embeddings for specific document IDs"""
+        return [self.relevance_vectors[doc_id] for doc_id in document_ids if doc_id in self.relevance_vectors]
+    
+    def get_topic_profiles(self, document_ids: List[str]) -> List[TopicProfile]:
+        """Get the upload-time topic profiles for specific document IDs"""
+        profiles = []
+        for doc_id in document_ids:
+            doc_info = self.uploaded_documents.get(doc_id)
+            if doc_info is None:
+                continue
+            if doc_info.topic_profile is None:
+                doc_info.topic_profile = self._build_topic_profile(self.document_content.get(doc_id, ""))
+            profiles.append(doc_info.topic_profile)
+        return profiles
+    
+    def get_document_set_version(self, document_ids: List[str]) -> str:
+        """Identifier of a document selection; uploads are never modified in place, so their IDs suffice"""
+        present = sorted(doc_id for doc_id in set(document_ids) if doc_id in self.uploaded_documents)
+        return hashlib.sha256("|".join(present).encode()).hexdigest()[:16]
+    
     def get_document_content(self, document_ids: List[str]) -> List[str]:
         """Get content for specific document IDs"""
         contents = []
@@ -123,6 +179,22 @@ class DocumentProcessor:
                 contents.append(self.document_content[doc_id])
         return contents
     
+    def get_document_refs(self, document_ids: List[str], excerpt_chars: int = 100) -> List[Dict[str, Any]]:
+        """Document IDs with the character span of a short excerpt, for recording in conversation memory"""
+        refs = []
+        for doc_id in document_ids:
+            if doc_id in self.document_content:
+                length = len(self.document_content[doc_id])
+                refs.append({"document_id": doc_id, "start": 0, "end": min(excerpt_chars, length), "length": length})
+        return refs
+    
+    def resolve_document_ref(self, ref: Dict[str, Any]) -> Optional[str]:
+        """Text a document reference points at, or None once the document is deleted"""
+        content = self.document_content.get(ref["document_id"])
+        if content is None:
+            return None
+        return content[ref["start"]:ref["end"]]
+    
     def get_all_documents(self) -> List[DocumentInfo]:
         """Get list of all uploaded documents"""
         return list(self.uploaded_documents.values())
@@ -133,6 +205,7 @@ class DocumentProcessor:
             del self.uploaded_documents[document_id]
         if document_id in self.document_content:
             del self.document_content[document_id]
+        self.relevance_vectors.pop(document_id, None)
 
         return True
 
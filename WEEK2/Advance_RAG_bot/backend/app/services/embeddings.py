@@ -0,0 +1,107 @@
+from typing import Any, Dict, Optional
+from concurrent.futures import Future
+import logging
+import threading
+import numpy as np
+from config import settings
+from services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SharedEncoder:
+    """Sentence encoder shared by retrieval, the relevance gate and document profiling.
+
+    The model loads once on first use. Query embeddings are memoized and concurrent
+    requests for the same query wait on a single encode, so a chat message is embedded
+    once however many components need it. Returned arrays are shared; don't modify them.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self.query_cache = TTLCache(maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE, ttl=settings.QUERY_EMBEDDING_CACHE_TTL)
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+                    self.logger.info(f"Encoder {self.model_name} loaded")
+        return self._model
+
+    def encode(self, sentences: Any, **kwargs) -> np.ndarray:
+        """Pass-through to SentenceTransformer.encode"""
+        return self.model.encode(sentences, **kwargs)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Embedding of one query with shape (1, dim), computed at most once while cached"""
+        entry = self.query_cache.get(query)
+        if entry is not None:
+            return entry.value
+
+        with self._lock:
+            future = self._in_flight.get(query)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[query] = future
+        if not owner:
+            return future.result()
+
+        try:
+            embedding = self.encode([query])
+            self.query_cache.set(query, embedding)
+            future.set_result(embedding)
+            return embedding
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(query, None)
+
+    def encode_document(self, text: str) -> Optional[np.ndarray]:
+        """Normalized embeddings of a document's chunks, with their normalized centroid as row 0"""
+        chunk_chars = settings.RELEVANCE_CHUNK_CHARS
+        chunks = [text[start:start + chunk_chars] for start in range(0, len(text), chunk_chars)]
+        chunks = [chunk for chunk in chunks if chunk.strip()]
+        if not chunks:
+            return None
+        if len(chunks) > settings.RELEVANCE_MAX_CHUNKS:
+            # Evenly spaced sample keeps upload time bounded for very large documents
+            step = len(chunks) / settings.RELEVANCE_MAX_CHUNKS
+            chunks = [chunks[int(i * step)] for i in range(settings.RELEVANCE_MAX_CHUNKS)]
+
+        vectors = np.asarray(self.encode(chunks, normalize_embeddings=True), dtype=np.float32)
+        centroid = vectors.mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        if norm > 0:
+            centroid = centroid / norm
+        return np.vstack([centroid, vectors])
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "query_cache": self.query_cache.get_stats()
+        }
+
+
+_shared_encoder: Optional[SharedEncoder] = None
+_shared_lock = threading.Lock()
+
+
+def get_encoder() -> SharedEncoder:
+    """Process-wide encoder instance"""
+    global _shared_encoder
+    if _shared_encoder is None:
+        with _shared_lock:
+            if _shared_encoder is None:
+                _shared_encoder = SharedEncoder(settings.EMBEDDING_MODEL)
+    return _shared_encoder
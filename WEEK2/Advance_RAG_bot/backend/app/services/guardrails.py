@@ -1,79 +1,283 @@
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import re
+import asyncio
+import functools
+import copy
+import hashlib
 import logging
-import torch
+import threading
+import time
+import numpy as np
+from config import settings
+from services.batch_inference import BatchingClassifier
+from services.keyword_matcher import KeywordMatcher
+from services.embeddings import get_encoder
+from services.onnx_classifier import ONNX_AVAILABLE, build_onnx_classifier
+from services.ttl_cache import TTLCache
+from models.models import TopicProfile
+
+# Document type patterns for relevance checking
+DOCUMENT_CATEGORIES = {
+    "medical": [
+        'medical', 'health', 'patient', 'diagnosis', 'treatment', 
+        'prescription', 'symptoms', 'doctor', 'hospital', 'clinical',
+        'medicine', 'healthcare', 'report', 'test results'
+    ],
+    "legal": [
+        'legal', 'law', 'contract', 'agreement', 'lawsuit', 'court',
+        'attorney', 'legal document', 'clause', 'jurisdiction'
+    ],
+    "financial": [
+        'financial', 'bank', 'loan', 'investment', 'tax', 'revenue',
+        'profit', 'loss', 'balance sheet', 'income statement'
+    ],
+    "technical": [
+        'technical', 'code', 'programming', 'software', 'hardware',
+        'system', 'network', 'database', 'algorithm'
+    ]
+}
 
 class EnhancedGuardrailsService:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # Checks run on their own threads: the default executor also carries blocking LLM calls that
+        # hold a thread for seconds, and the batcher only fills if many checks can wait at once
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.GUARDRAIL_EXECUTOR_WORKERS,
+            thread_name_prefix="guardrails"
+        )
+        
+        # Classifiers load on first use or from warm_up(), so constructing the service is cheap
+        self.toxicity_classifier = None
+        self.nsfw_classifier = None
+        self.model_names = {
+            "toxicity": settings.TOXICITY_MODEL,
+            "nsfw": settings.GUARDRAIL_MODEL
+        }
+        # Runtime per classifier: "pytorch" or "onnx" (exported, int8-quantized)
+        self.model_backends = {
+            "toxicity": settings.TOXICITY_BACKEND,
+            "nsfw": "pytorch"
+        }
+        self.model_status = {
+            name: {
+                "model": model_name,
+                "backend": self.model_backends[name],
+                "state": "not_loaded",
+                "load_seconds": None,
+                "error": None
+            }
+            for name, model_name in self.model_names.items()
+        }
+        self.model_status["encoder"] = {
+            "model": settings.EMBEDDING_MODEL,
+            "backend": "sentence-transformers",
+            "state": "not_loaded",
+            "load_seconds": None,
+            "error": None
+        }
+        self._load_lock = threading.Lock()
+        # Concurrent requests share padded inference batches per classifier
+        self.batchers: Dict[str, BatchingClassifier] = {}
+        
+        # Checks run as ordered stages from settings; each can end validation early
+        self.stages = {
+            "keywords": self._stage_keywords,
+            "cache": self._stage_cache,
+            "relevance": self._stage_relevance,
+            "nsfw_model": self._stage_nsfw_model,
+            "toxicity": self._stage_toxicity
+        }
+        self.pipeline = [stage for stage in settings.GUARDRAIL_PIPELINE if stage in self.stages]
+        for stage in set(settings.GUARDRAIL_PIPELINE) - set(self.stages):
+            self.logger.warning(f"Ignoring unknown guardrail stage: {stage}")
+        self.stage_stats = {
+            stage: {"runs": 0, "rejects": 0, "accepts": 0, "total_ms": 0.0} for stage in self.pipeline
+        }
+        self.safe_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in settings.GUARDRAIL_SAFE_PATTERNS]
+        
+        # Recent verdicts, keyed by message, images, document selection and policy version
+        self.verdict_cache = TTLCache(maxsize=settings.GUARDRAIL_CACHE_SIZE, ttl=settings.GUARDRAIL_CACHE_TTL)
+        self._policy_version = None
         
-        # Initialize toxicity classifier with better model
+        # Question embeddings are shared with retrieval through the encoder's query memo
+        self.encoder = get_encoder()
+        
+        # Shared with DocumentProcessor, which profiles each document once at upload
+        self.document_categories = DOCUMENT_CATEGORIES
+        self.nsfw_keywords = [
+            'porn', 'nude', 'sexual', 'explicit', 'adult content',
+            'nsfw', 'not safe for work', 'erotic', 'xxx', 'pornography',
+            'naked', 'sex', 'adult', 'mature content',
+            'inappropriate', 'lewd', 'vulgar', 'obscene'
+        ]
+        # Each keyword scan is a single pass over the text with a precompiled matcher
+        self.topic_matcher = KeywordMatcher(self.document_categories)
+        self.nsfw_matcher = KeywordMatcher({"nsfw": self.nsfw_keywords})
+    
+    def _load_classifier(self, name: str):
+        """Load one classifier pipeline; transformers is imported here to keep app import fast"""
+        status = self.model_status[name]
+        status["state"] = "loading"
+        started = time.monotonic()
         try:
-            self.toxicity_classifier = pipeline(
-                "text-classification",
-                model="unitary/toxic-bert",
-                tokenizer="unitary/toxic-bert",
-                device=0 if torch.cuda.is_available() else -1
+            from transformers import pipeline
+            import torch
+            
+            backend = self.model_backends[name]
+            if backend == "onnx" and not ONNX_AVAILABLE:
+                self.logger.warning(f"optimum[onnxruntime] is not installed, running the {name} classifier on PyTorch")
+                backend = "pytorch"
+            
+            classifier = None
+            if backend == "onnx":
+                try:
+                    classifier = build_onnx_classifier(self.model_names[name])
+                except (ImportError, RuntimeError) as e:
+                    # optimum is present but can't load (usually a torch/transformers version mismatch)
+                    self.logger.warning(f"ONNX Runtime backend unavailable ({e}), running the {name} classifier on PyTorch")
+                    backend = "pytorch"
+            if classifier is None:
+                classifier = pipeline(
+                    "text-classification",
+                    model=self.model_names[name],
+                    tokenizer=self.model_names[name],
+                    device=0 if torch.cuda.is_available() else -1
+                )
+            status["backend"] = backend
+            # First inference allocates buffers; pay that cost here rather than on a user request
+            classifier("warm up")
+            self.batchers[name] = BatchingClassifier(
+                name,
+                lambda texts: classifier(texts, batch_size=len(texts), truncation=True, top_k=None),
+                max_batch_size=settings.GUARDRAIL_BATCH_MAX_SIZE,
+                max_wait_ms=settings.GUARDRAIL_BATCH_MAX_WAIT_MS
             )
-            self.logger.info("Toxicity classifier initialized successfully")
+            setattr(self, f"{name}_classifier", classifier)
+            status["state"] = "ready"
+            self.logger.info(f"{name} classifier ({self.model_names[name]}) initialized successfully")
         except Exception as e:
-            self.logger.error(f"Failed to initialize toxicity classifier: {e}")
-            self.toxicity_classifier = None
-        
-        # Initialize NSFW content detector
+            status["state"] = "failed"
+            status["error"] = str(e)
+            self.logger.error(f"Failed to initialize {name} classifier: {e}")
+        finally:
+            status["load_seconds"] = round(time.monotonic() - started, 2)
+    
+    def _get_classifier(self, name: str):
+        """Get a classifier, loading it on first use; concurrent callers wait for the same load"""
+        if self.model_status[name]["state"] not in ("ready", "failed"):
+            with self._load_lock:
+                if self.model_status[name]["state"] not in ("ready", "failed"):
+                    self._load_classifier(name)
+        return getattr(self, f"{name}_classifier")
+    
+    def _load_encoder(self):
+        """Load the shared sentence encoder the relevance stage embeds questions with"""
+        status = self.model_status["encoder"]
+        status["state"] = "loading"
+        started = time.monotonic()
         try:
-            self.nsfw_classifier = pipeline(
-                "text-classification",
-                model="microsoft/DialoGPT-medium",
-                device=0 if torch.cuda.is_available() else -1
-            )
-            self.logger.info("NSFW classifier initialized successfully")
+            self.encoder.encode(["warm up"])
+            status["state"] = "ready"
         except Exception as e:
-            self.logger.error(f"Failed to initialize NSFW classifier: {e}")
-            self.nsfw_classifier = None
-        
-        # Document type patterns for relevance checking
-        self.document_categories = {
-            "medical": [
-                'medical', 'health', 'patient', 'diagnosis', 'treatment', 
-                'prescription', 'symptoms', 'doctor', 'hospital', 'clinical',
-                'medicine', 'healthcare', 'report', 'test results'
-            ],
-            "legal": [
-                'legal', 'law', 'contract', 'agreement', 'lawsuit', 'court',
-                'attorney', 'legal document', 'clause', 'jurisdiction'
-            ],
-            "financial": [
-                'financial', 'bank', 'loan', 'investment', 'tax', 'revenue',
-                'profit', 'loss', 'balance sheet', 'income statement'
-            ],
-            "technical": [
-                'technical', 'code', 'programming', 'software', 'hardware',
-                'system', 'network', 'database', 'algorithm'
-            ]
+            status["state"] = "failed"
+            status["error"] = str(e)
+            self.logger.error(f"Failed to load encoder {settings.EMBEDDING_MODEL}: {e}")
+        finally:
+            status["load_seconds"] = round(time.monotonic() - started, 2)
+    
+    def warm_up(self):
+        """Load and warm the encoder and every classifier (run in the background after startup)"""
+        self._load_encoder()
+        for name in self.model_names:
+            self._get_classifier(name)
+    
+    async def run(self, check: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking guardrail check on the guardrail thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(check, *args))
+    
+    def get_readiness(self) -> Dict[str, Any]:
+        """Report whether all guardrail models have finished loading"""
+        return {
+            "ready": all(status["state"] in ("ready", "failed") for status in self.model_status.values()),
+            "models": self.model_status
+        }
+    
+    def get_batching_stats(self) -> Dict[str, Any]:
+        """Batch sizes and timings of the guardrail inference workers"""
+        return {name: batcher.get_stats() for name, batcher in self.batchers.items()}
+    
+    def _score_text(self, name: str, text: str, labels: List[str], threshold: float):
+        """Highest score over `labels` for the whole text.
+        
+        The text is tokenized once into overlapping model-sized windows. A text that fits one
+        window goes through the shared batcher; longer ones are scored window by window, and
+        checking stops at the first window batch that crosses the threshold.
+        """
+        classifier = getattr(self, f"{name}_classifier")
+        tokenizer = classifier.tokenizer
+        max_length = min(tokenizer.model_max_length, 512)
+        windows = tokenizer(
+            text,
+            max_length=max_length,
+            stride=min(settings.GUARDRAIL_WINDOW_OVERLAP, max_length // 2),
+            truncation=True,
+            return_overflowing_tokens=True
+        )
+        windows.pop("overflow_to_sample_mapping", None)
+        if len(windows["input_ids"]) <= 1:
+            results = self.batchers[name].classify(text)
+            score = max([result['score'] for result in results if result['label'].lower() in labels], default=0.0)
+            return score, results
+        return self._scan_windows(name, windows, labels, threshold)
+    
+    def _scan_windows(self, name: str, windows: Dict[str, Any], labels: List[str], threshold: float):
+        """Score the token windows of a long text with the classifier's own model"""
+        import torch
+        
+        classifier = getattr(self, f"{name}_classifier")
+        tokenizer, model = classifier.tokenizer, classifier.model
+        encoded = tokenizer.pad(windows, padding=True, return_tensors="pt")
+        total_windows = encoded["input_ids"].shape[0]
+        # Match the pipeline: independent sigmoids for multi-label heads, softmax otherwise
+        multi_label = model.config.problem_type == "multi_label_classification" or model.config.num_labels == 1
+        label_ids = [i for i, label in model.config.id2label.items() if label.lower() in labels]
+        window_batch = max(settings.GUARDRAIL_WINDOW_BATCH, 1)
+        
+        best_score, best_window, windows_checked = 0.0, 0, 0
+        for start in range(0, total_windows, window_batch):
+            batch = {key: value[start:start + window_batch].to(model.device) for key, value in encoded.items()}
+            with torch.no_grad():
+                logits = model(**batch).logits
+            probabilities = torch.sigmoid(logits) if multi_label else torch.softmax(logits, dim=-1)
+            window_scores = probabilities[:, label_ids].max(dim=-1).values if label_ids else torch.zeros(len(logits))
+            windows_checked += len(window_scores)
+            batch_best = float(window_scores.max())
+            if batch_best > best_score:
+                best_score, best_window = batch_best, start + int(window_scores.argmax())
+            if best_score > threshold:
+                break
+        
+        return best_score, {
+            "total_windows": total_windows,
+            "windows_checked": windows_checked,
+            "max_window": best_window
         }
     
     def check_toxicity(self, text: str) -> Dict[str, Any]:
         """Check if text contains toxic content with enhanced detection"""
-        if not self.toxicity_classifier:
+        if not self._get_classifier("toxicity"):
             return {"is_toxic": False, "score": 0.0, "safe": True}
         
         try:
-            # Truncate text to avoid token limits
-            text_to_check = text[:512]
-            results = self.toxicity_classifier(text_to_check)
-            
-            # Extract toxic labels and their scores
             toxic_labels = ['toxic', 'obscene', 'insult', 'threat', 'identity_hate']
-            toxic_score = 0.0
-            
-            for result in results:
-                if result['label'] in toxic_labels:
-                    toxic_score = max(toxic_score, result['score'])
+            # Covers the whole message rather than a truncated prefix
+            toxic_score, details = self._score_text("toxicity", text, toxic_labels, settings.TOXICITY_THRESHOLD)
             
             # Enhanced threshold for better detection
-            is_toxic = toxic_score > 0.6
+            is_toxic = toxic_score > settings.TOXICITY_THRESHOLD
             
             self.logger.info(f"Toxicity check - Score: {toxic_score:.3f}, Toxic: {is_toxic}")
             
@@ -81,53 +285,74 @@ class EnhancedGuardrailsService:
                 "is_toxic": is_toxic,
                 "score": toxic_score,
                 "safe": not is_toxic,
-                "details": results
+                "details": details
             }
         except Exception as e:
             self.logger.error(f"Toxicity check failed: {e}")
-            return {"is_toxic": False, "score": 0.0, "safe": True}
+            return {"is_toxic": False, "score": 0.0, "safe": True, "error": str(e)}
     
-    def check_nsfw_request(self, text: str, images: List[str] = None) -> Dict[str, Any]:
+    def check_nsfw_request(self, text: str, images: List[str] = None, use_model: bool = True) -> Dict[str, Any]:
         """Enhanced NSFW content detection"""
-        # Extended NSFW keywords list
-        nsfw_keywords = [
-            'porn', 'nude', 'sexual', 'explicit', 'adult content',
-            'nsfw', 'not safe for work', 'erotic', 'xxx', 'pornography',
-            'naked', 'nude', 'sex', 'porn', 'adult', 'mature content',
-            'inappropriate', 'lewd', 'vulgar', 'obscene'
-        ]
-        
-        text_lower = text.lower()
-        detected_keywords = []
-        
-        for keyword in nsfw_keywords:
-            if keyword in text_lower:
-                detected_keywords.append(keyword)
+        detected_keywords = self.nsfw_matcher.find_keywords(text)
         
-        # Use ML model for additional NSFW detection if available
+        # Keyword hits are decisive; otherwise ask the ML classifier (labels NSFW / SFW)
         ml_nsfw_score = 0.0
-        if self.nsfw_classifier and detected_keywords:
+        ml_error = None
+        if use_model and not detected_keywords and self._get_classifier("nsfw"):
             try:
-                results = self.nsfw_classifier(text[:256])
-                ml_nsfw_score = max([result['score'] for result in results if 'nsfw' in result['label'].lower()])
+                ml_nsfw_score, _ = self._score_text("nsfw", text, ['nsfw'], settings.NSFW_THRESHOLD)
             except Exception as e:
                 self.logger.warning(f"ML NSFW detection failed: {e}")
+                ml_error = str(e)
         
-        is_nsfw = len(detected_keywords) > 0 or ml_nsfw_score > 0.7
+        is_nsfw = len(detected_keywords) > 0 or ml_nsfw_score > settings.NSFW_THRESHOLD
         
         self.logger.info(f"NSFW check - Keywords: {detected_keywords}, ML Score: {ml_nsfw_score:.3f}, NSFW: {is_nsfw}")
         
-        return {
+        result = {
             "is_nsfw": is_nsfw,
             "detected_keywords": detected_keywords,
             "ml_score": ml_nsfw_score,
             "safe": not is_nsfw
         }
+        if ml_error:
+            result["error"] = ml_error
+        return result
+    
+    def check_output(self, text: str) -> Dict[str, Any]:
+        """Score a window of model output with the ML classifiers.
+        
+        The NSFW keyword list targets requests ("explicit", "adult", ...) and would cut off
+        ordinary answers, so only the models are used here.
+        """
+        reasons = []
+        toxicity_check = self.check_toxicity(text)
+        if not toxicity_check["safe"]:
+            reasons.append(f"Toxic content detected (score: {toxicity_check['score']:.3f})")
+        
+        nsfw_score = 0.0
+        if self._get_classifier("nsfw"):
+            try:
+                nsfw_score, _ = self._score_text("nsfw", text, ['nsfw'], settings.NSFW_THRESHOLD)
+            except Exception as e:
+                self.logger.warning(f"ML NSFW output check failed: {e}")
+        if nsfw_score > settings.NSFW_THRESHOLD:
+            reasons.append(f"NSFW content detected (score: {nsfw_score:.3f})")
+        
+        return {
+            "safe": not reasons,
+            "toxicity_score": toxicity_check["score"],
+            "nsfw_score": nsfw_score,
+            "reason": "; ".join(reasons) if reasons else None
+        }
     
-    def check_document_relevance(self, user_question: str, document_context: List[str]) -> Dict[str, Any]:
-        """Check if user question is relevant to uploaded documents"""
+    def check_document_relevance(self, user_question: str, document_context: List[str],
+                                 topic_profiles: Optional[List[TopicProfile]] = None,
+                                 document_vectors: Optional[List[np.ndarray]] = None,
+                                 previous_question: Optional[str] = None) -> Dict[str, Any]:
+        """Check if user question is relevant to uploaded documents; follow-ups are read with `previous_question`"""
         try:
-            if not document_context:
+            if not document_context and not topic_profiles:
                 return {
                     "is_relevant": True, 
                     "reason": "No documents uploaded",
@@ -135,8 +360,19 @@ class EnhancedGuardrailsService:
                     "question_topics": []
                 }
             
-            # Extract document topics
-            document_topics = self._extract_document_topics(document_context)
+            # Topics come from the profiles computed at upload; scanning the text is only a fallback
+            if topic_profiles:
+                document_topics = sorted({category for profile in topic_profiles for category in profile.categories})
+            else:
+                document_topics = self._extract_document_topics(document_context)
+            
+            if document_vectors:
+                try:
+                    return self._check_embedding_relevance(
+                        user_question, document_vectors, document_topics, previous_question
+                    )
+                except Exception as e:
+                    self.logger.warning(f"Embedding relevance check failed, using keywords: {e}")
             question_topics = self._extract_question_topics(user_question)
             
             # Check relevance
@@ -154,34 +390,47 @@ class EnhancedGuardrailsService:
                 "is_relevant": True,
                 "document_topics": [],
                 "question_topics": [],
-                "reason": "Error in relevance check, allowing question"
+                "reason": "Error in relevance check, allowing question",
+                "error": str(e)
             }
     
-    def _extract_document_topics(self, document_context: List[str]) -> List[str]:
-        """Extract main topics from document context"""
-        topics = []
-        full_text = " ".join(document_context).lower()
+    def _check_embedding_relevance(self, user_question: str, document_vectors: List[np.ndarray],
+                                   document_topics: List[str], previous_question: Optional[str] = None) -> Dict[str, Any]:
+        """Compare the question embedding with each document's centroid and chunk embeddings"""
+        similarity = self._document_similarity(user_question, document_vectors)
+        is_relevant = similarity >= settings.RELEVANCE_THRESHOLD
+        follow_up = False
+        if not is_relevant and previous_question:
+            # Follow-ups like "explain that in more detail" carry their topic in the previous question
+            similarity = max(similarity, self._document_similarity(f"{previous_question}\n{user_question}", document_vectors))
+            is_relevant = follow_up = similarity >= settings.RELEVANCE_THRESHOLD
         
-        for category, keywords in self.document_categories.items():
-            for keyword in keywords:
-                if keyword in full_text:
-                    topics.append(category)
-                    break  # Add category only once
+        self.logger.info(f"Relevance check - Similarity: {similarity:.3f}, Relevant: {is_relevant}, Follow-up: {follow_up}")
         
-        return list(set(topics))
+        return {
+            "is_relevant": is_relevant,
+            "similarity": similarity,
+            "follow_up": follow_up,
+            "document_topics": document_topics,
+            "question_topics": self._extract_question_topics(user_question),
+            "reason": "Question is outside document scope" if not is_relevant else "Question is relevant to documents"
+        }
+    
+    def _document_similarity(self, text: str, document_vectors: List[np.ndarray]) -> float:
+        """Best cosine similarity between the text and any document centroid or chunk"""
+        embedding = self.encoder.encode_query(text)[0]
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        return max(float(np.max(vectors @ embedding)) for vectors in document_vectors)
+    
+    def _extract_document_topics(self, document_context: List[str]) -> List[str]:
+        """Extract main topics from document context"""
+        return self.topic_matcher.find_categories(document_context)
     
     def _extract_question_topics(self, question: str) -> List[str]:
         """Extract topics from user question"""
-        topics = []
-        question_lower = question.lower()
-        
-        for category, keywords in self.document_categories.items():
-            for keyword in keywords:
-                if keyword in question_lower:
-                    topics.append(category)
-                    break
-        
-        return topics
+        return self.topic_matcher.find_categories([question])
     
     def _check_topic_relevance(self, question_topics: List[str], document_topics: List[str]) -> bool:
         """Check if question topics are relevant to document topics"""
@@ -194,16 +443,171 @@ class EnhancedGuardrailsService:
         # Check if any question topic matches document topics
         return any(topic in document_topics for topic in question_topics)
     
-    def validate_request(self, message: str, images: List[str] = None, document_context: List[str] = None) -> Dict[str, Any]:
-        """Enhanced validation with comprehensive safety checks"""
+    def get_policy_version(self) -> str:
+        """Fingerprint of the models, thresholds and keyword lists; a new value empties the verdict cache"""
+        policy = (
+            tuple(self.model_names.items()),
+            tuple(self.model_backends.items()),
+            tuple(status["state"] == "failed" for status in self.model_status.values()),
+            settings.TOXICITY_THRESHOLD,
+            settings.NSFW_THRESHOLD,
+            settings.RELEVANCE_THRESHOLD,
+            settings.EMBEDDING_MODEL,
+            tuple(self.pipeline),
+            tuple(pattern.pattern for pattern in self.safe_patterns),
+            tuple(self.nsfw_keywords),
+            tuple((category, tuple(keywords)) for category, keywords in self.document_categories.items())
+        )
+        version = hashlib.sha256(repr(policy).encode()).hexdigest()[:16]
+        if version != self._policy_version:
+            if self._policy_version is not None:
+                self.logger.info(f"Guardrail policy changed ({self._policy_version} -> {version}), clearing verdict cache")
+                self.verdict_cache.invalidate()
+            self._policy_version = version
+        return version
+    
+    def _verdict_cache_key(self, message: str, images: Optional[List[str]], document_context: Optional[List[str]],
+                           document_set_version: Optional[str], previous_question: Optional[str] = None):
+        """Cache key for a verdict, or None when the document selection can't be identified"""
+        if document_context and document_set_version is None:
+            return None
+        return (
+            hashlib.sha256(message.encode()).hexdigest(),
+            tuple(hashlib.sha256(image.encode()).hexdigest() for image in images or []),
+            document_set_version or "",
+            # A follow-up's relevance depends on the question before it
+            hashlib.sha256(previous_question.encode()).hexdigest() if document_context and previous_question else "",
+            self.get_policy_version()
+        )
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Verdict cache hit rates and the current policy version"""
+        return {"policy_version": self.get_policy_version(), **self.verdict_cache.get_stats()}
+    
+    def get_pipeline_stats(self) -> Dict[str, Any]:
+        """Stage order with how often each stage ran, decided and how long it took"""
+        return {
+            "pipeline": self.pipeline,
+            "stages": {
+                stage: {
+                    **stats,
+                    "avg_ms": stats["total_ms"] / stats["runs"] if stats["runs"] else 0.0
+                }
+                for stage, stats in self.stage_stats.items()
+            }
+        }
+    
+    def _is_clearly_safe(self, message: str, images: Optional[List[str]]) -> bool:
+        """Short messages such as greetings that match a configured safe pattern"""
+        text = message.strip()
+        return (
+            not images
+            and len(text) <= settings.GUARDRAIL_SAFE_MAX_CHARS
+            and any(pattern.fullmatch(text) for pattern in self.safe_patterns)
+        )
+    
+    def _stage_keywords(self, state: Dict[str, Any]) -> Optional[str]:
+        """NSFW keyword scan: a hit rejects, a clearly safe message is accepted"""
+        nsfw_check = self.check_nsfw_request(state["message"], state["images"], use_model=False)
+        state["checks"]["nsfw"] = nsfw_check
+        if not nsfw_check["safe"]:
+            return "reject"
+        if self._is_clearly_safe(state["message"], state["images"]):
+            return "accept"
+        return None
+    
+    def _stage_cache(self, state: Dict[str, Any]) -> Optional[str]:
+        """Reuse a recent verdict for the same message, images, documents and policy"""
+        state["cache_key"] = self._verdict_cache_key(
+            state["message"], state["images"], state["document_context"], state["document_set_version"],
+            state["previous_question"]
+        )
+        if state["cache_key"] is None:
+            return None
+        entry = self.verdict_cache.get(state["cache_key"])
+        if entry is None:
+            return None
+        state["cached"] = entry.value
+        return "accept" if entry.value["safe"] else "reject"
+    
+    def _stage_relevance(self, state: Dict[str, Any]) -> Optional[str]:
+        relevance_check = self.check_document_relevance(
+            state["message"], state["document_context"] or [], state["topic_profiles"], state["document_vectors"],
+            state["previous_question"]
+        )
+        state["checks"]["relevance"] = relevance_check
+        return None if relevance_check["is_relevant"] else "reject"
+    
+    def _stage_nsfw_model(self, state: Dict[str, Any]) -> Optional[str]:
+        nsfw_check = self.check_nsfw_request(state["message"], state["images"])
+        state["checks"]["nsfw"] = nsfw_check
+        return None if nsfw_check["safe"] else "reject"
+    
+    def _stage_toxicity(self, state: Dict[str, Any]) -> Optional[str]:
+        toxicity_check = self.check_toxicity(state["message"])
+        state["checks"]["toxicity"] = toxicity_check
+        return None if toxicity_check["safe"] else "reject"
+    
+    def validate_request(self, message: str, images: List[str] = None, document_context: List[str] = None,
+                         topic_profiles: Optional[List[TopicProfile]] = None,
+                         document_vectors: Optional[List[np.ndarray]] = None,
+                         document_set_version: Optional[str] = None,
+                         previous_question: Optional[str] = None) -> Dict[str, Any]:
+        """Run the guardrail pipeline cheapest stage first, stopping at the first decisive accept or reject"""
         self.logger.info(f"Validating request: {message[:50]}...")
+        state = {
+            "message": message,
+            "images": images,
+            "document_context": document_context,
+            "topic_profiles": topic_profiles,
+            "document_vectors": document_vectors,
+            "document_set_version": document_set_version,
+            "previous_question": previous_question,
+            "checks": {},
+            "cache_key": None,
+            "cached": None
+        }
         
-        # Basic safety checks
-        toxicity_check = self.check_toxicity(message)
-        nsfw_check = self.check_nsfw_request(message, images)
+        stage_timings = []
+        for stage in self.pipeline:
+            started = time.perf_counter()
+            decision = self.stages[stage](state)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            
+            stats = self.stage_stats[stage]
+            stats["runs"] += 1
+            stats["total_ms"] += elapsed_ms
+            if decision is not None:
+                stats[f"{decision}s"] += 1
+            stage_timings.append({"stage": stage, "ms": round(elapsed_ms, 3), "decision": decision})
+            if decision is not None:
+                break
+        
+        if state["cached"] is not None:
+            result = copy.deepcopy(state["cached"])
+            result["validation_details"]["stages"] = stage_timings
+            self.logger.info(f"Validation result served from cache - Safe: {result['safe']}")
+            return result
         
-        # Document relevance check
-        relevance_check = self.check_document_relevance(message, document_context or [])
+        result = self._build_verdict(state["checks"], stage_timings)
+        
+        # Verdicts that fell back after a check error are not reused
+        checks = state["checks"].values()
+        if state["cache_key"] is not None and not any("error" in check for check in checks):
+            self.verdict_cache.set(state["cache_key"], copy.deepcopy(result))
+        return result
+    
+    def _build_verdict(self, checks: Dict[str, Dict[str, Any]], stage_timings: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Combine the checks that ran into a verdict; skipped checks count as passed"""
+        toxicity_check = checks.get("toxicity", {"is_toxic": False, "score": 0.0, "safe": True, "skipped": True})
+        nsfw_check = checks.get("nsfw", {"is_nsfw": False, "detected_keywords": [], "ml_score": 0.0, "safe": True, "skipped": True})
+        relevance_check = checks.get("relevance", {
+            "is_relevant": True,
+            "document_topics": [],
+            "question_topics": [],
+            "reason": "Not checked",
+            "skipped": True
+        })
         
         # Determine overall safety
         is_safe = (
@@ -218,9 +622,13 @@ class EnhancedGuardrailsService:
             reasons = []
             if not toxicity_check["safe"]:
                 reasons.append(f"Toxic content detected (score: {toxicity_check['score']:.3f})")
-            if not nsfw_check["safe"]:
+            if not nsfw_check["safe"] and nsfw_check["detected_keywords"]:
                 reasons.append(f"NSFW content detected (keywords: {', '.join(nsfw_check['detected_keywords'])})")
-            if not relevance_check["is_relevant"]:
+            elif not nsfw_check["safe"]:
+                reasons.append(f"NSFW content detected (score: {nsfw_check['ml_score']:.3f})")
+            if not relevance_check["is_relevant"] and "similarity" in relevance_check:
+                reasons.append(f"Question not relevant to documents (similarity: {relevance_check['similarity']:.3f})")
+            elif not relevance_check["is_relevant"]:
                 reasons.append(f"Question not relevant to documents (topics: {', '.join(relevance_check['document_topics'])})")
             
             rejection_reason = "; ".join(reasons)
@@ -239,6 +647,7 @@ class EnhancedGuardrailsService:
             "validation_details": {
                 "toxicity": toxicity_check,
                 "nsfw": nsfw_check,
-                "relevance": relevance_check
+                "relevance": relevance_check,
+                "stages": stage_timings
             }
-        }
\ No newline at end of file
+        }
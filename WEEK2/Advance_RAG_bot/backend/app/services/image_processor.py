@@ -0,0 +1,126 @@
+from typing import Any, Dict, List, Optional
+from PIL import Image, ImageOps
+import base64
+import binascii
+import hashlib
+import io
+import logging
+from config import settings
+from services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Magic-number prefixes of the formats the providers accept
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def sniff_mime_type(data: bytes) -> Optional[str]:
+    """Detect the image format from its leading bytes"""
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class ImageProcessor:
+    """Sniff, downsample and re-encode chat images to what each provider can use"""
+
+    def __init__(self):
+        self.cache = TTLCache(maxsize=settings.IMAGE_CACHE_SIZE, ttl=settings.IMAGE_CACHE_TTL)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.images_processed = 0
+        self.logger = logging.getLogger(__name__)
+
+    def prepare(self, image_b64: str, provider: str) -> Optional[Dict[str, Any]]:
+        """Turn a base64 upload into {"mime_type", "data", "base64"} sized for the provider"""
+        # Accept data URLs as well as bare base64
+        if image_b64.startswith("data:") and "," in image_b64:
+            image_b64 = image_b64.split(",", 1)[1]
+        try:
+            raw = base64.b64decode(image_b64, validate=False)
+        except (binascii.Error, ValueError) as e:
+            self.logger.warning(f"Failed to decode image: {e}")
+            return None
+
+        cache_key = (hashlib.sha256(raw).hexdigest(), provider)
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            return entry.value
+
+        mime_type = sniff_mime_type(raw)
+        if mime_type is None:
+            self.logger.warning("Skipping image with unrecognized format")
+            return None
+
+        try:
+            data, mime_type = self._reduce(raw, mime_type, provider)
+        except Exception as e:
+            self.logger.warning(f"Image processing failed, sending original: {e}")
+            data = raw
+
+        prepared = {
+            "mime_type": mime_type,
+            "data": data,
+            "base64": base64.b64encode(data).decode("ascii")
+        }
+        self.cache.set(cache_key, prepared)
+        self.bytes_in += len(raw)
+        self.bytes_out += len(data)
+        self.images_processed += 1
+        self.logger.info(f"Prepared {mime_type} image for {provider}: {len(raw)} -> {len(data)} bytes")
+        return prepared
+
+    def prepare_many(self, images: Optional[List[str]], provider: str) -> List[Dict[str, Any]]:
+        """Prepare several images, skipping any that cannot be processed"""
+        prepared = [self.prepare(image, provider) for image in images or []]
+        return [image for image in prepared if image is not None]
+
+    def _reduce(self, raw: bytes, mime_type: str, provider: str):
+        """Downsample to the provider's useful resolution and re-encode, keeping whichever is smaller"""
+        max_dimension = settings.IMAGE_MAX_DIMENSION.get(provider, settings.IMAGE_MAX_DIMENSION.get("default", 1536))
+
+        with Image.open(io.BytesIO(raw)) as image:
+            if getattr(image, "is_animated", False):
+                # Only the first frame is sent; providers treat images as stills
+                image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            resized = max(image.size) > max_dimension
+            if resized:
+                image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            output = io.BytesIO()
+            if has_alpha:
+                image.save(output, format="PNG", optimize=True)
+                new_mime_type = "image/png"
+            else:
+                image.convert("RGB").save(
+                    output,
+                    format="JPEG",
+                    quality=settings.IMAGE_JPEG_QUALITY,
+                    optimize=True,
+                    progressive=True
+                )
+                new_mime_type = "image/jpeg"
+
+        encoded = output.getvalue()
+        if not resized and len(raw) <= len(encoded) and mime_type != "image/gif":
+            return raw, mime_type
+        return encoded, new_mime_type
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "images_processed": self.images_processed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "reduction_ratio": 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0.0,
+            "cache": self.cache.get_stats()
+        }
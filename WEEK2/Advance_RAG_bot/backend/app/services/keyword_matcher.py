@@ -0,0 +1,96 @@
+from typing import Dict, Iterable, Iterator, List, Set
+from collections import Counter
+import re
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+
+def _trie_pattern(node: Dict[str, dict]) -> str:
+    """Serialize a character trie into a regex so shared prefixes are only tried once"""
+    end = "" in node
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    if len(branches) == 1 and not end:
+        return branches[0]
+    pattern = "(?:" + "|".join(branches) + ")"
+    # A keyword ending here makes the longer continuations optional
+    return pattern + "?" if end else pattern
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class KeywordMatcher:
+    """Find many keywords in one pass over the text.
+
+    Keywords are matched case-insensitively at word starts, so "report" matches "reports"
+    but "sex" does not match "essex". An Aho-Corasick automaton is used when pyahocorasick
+    is installed, otherwise a single trie-shaped regex. Keywords can be grouped into categories.
+    """
+
+    def __init__(self, keywords: Dict[str, Iterable[str]]):
+        self.categories_by_keyword: Dict[str, Set[str]] = {}
+        for category, words in keywords.items():
+            for word in words:
+                self.categories_by_keyword.setdefault(word.lower(), set()).add(category)
+        self.categories = set(keywords)
+
+        if AHOCORASICK_AVAILABLE:
+            self.automaton = ahocorasick.Automaton()
+            for word in self.categories_by_keyword:
+                self.automaton.add_word(word, word)
+            self.automaton.make_automaton()
+        else:
+            self.automaton = None
+            trie: Dict[str, dict] = {}
+            for word in self.categories_by_keyword:
+                node = trie
+                for char in word:
+                    node = node.setdefault(char, {})
+                node[""] = {}
+            self.pattern = re.compile(r"\b" + _trie_pattern(trie))
+            # The regex reports the longest keyword at each position; shorter keywords that are
+            # its prefixes ("porn" inside "pornography") count as found too
+            self._prefix_keywords = {
+                word: [other for other in self.categories_by_keyword if word.startswith(other)]
+                for word in self.categories_by_keyword
+            }
+
+    def _iter_keywords(self, text: str) -> Iterator[str]:
+        text = text.lower()
+        if self.automaton is not None:
+            for end, word in self.automaton.iter(text):
+                start = end - len(word) + 1
+                if start == 0 or not _is_word_char(text[start - 1]):
+                    yield word
+        else:
+            for match in self.pattern.finditer(text):
+                yield from self._prefix_keywords[match.group()]
+
+    def find_keywords(self, text: str) -> List[str]:
+        """Every keyword that occurs in the text, in order of first occurrence"""
+        return list(dict.fromkeys(self._iter_keywords(text)))
+
+    def find_categories(self, texts: Iterable[str]) -> List[str]:
+        """Categories with at least one keyword hit, stopping once every category has been seen"""
+        found: Set[str] = set()
+        for text in texts:
+            for keyword in self._iter_keywords(text):
+                found.update(self.categories_by_keyword[keyword])
+                if found == self.categories:
+                    return sorted(found)
+        return sorted(found)
+
+    def count_keywords(self, text: str) -> Dict[str, int]:
+        """Number of hits per keyword over the whole text"""
+        return dict(Counter(self._iter_keywords(text)))
+
+    def categories_for(self, keywords: Iterable[str]) -> List[str]:
+        """Categories covered by already-found keywords"""
+        return sorted({category for keyword in keywords for category in self.categories_by_keyword.get(keyword, ())})
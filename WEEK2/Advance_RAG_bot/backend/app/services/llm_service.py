@@ -1,21 +1,56 @@
 import google.generativeai as genai
 from groq import Groq
 import cohere
-import base64
-import requests
-from typing import List, Optional, Dict, Any
+import httpx
+from typing import List, Optional, Dict, Any, Set, Callable, Awaitable, AsyncIterator, Iterator
 import os
+import copy
 import logging
+import asyncio
+import random
+import threading
 from config import settings
+from services.single_flight import SingleFlight, normalize_key
+from services.rate_limiter import RateLimiterRegistry, ProviderBusyError, ProviderError
+from services.token_usage import TokenUsageTracker, count_tokens
+from services.ttl_cache import TTLCache
+from services.image_processor import ImageProcessor
+from services.mock_providers import MockProfile, MockGenerativeModel, MockGroqClient, MockCohereClient, MockSerper
 
 logger = logging.getLogger(__name__)
 
 class LLMService:
     def __init__(self):
-        # Initialize clients only if API keys are available
         self.groq_client = None
         self.cohere_client = None
+        self.gemini_models: Dict[str, Any] = {}
+        self.single_flight = SingleFlight("llm")
+        self.rate_limiter = RateLimiterRegistry()
+        self.token_usage = TokenUsageTracker()
+        self.image_processor = ImageProcessor()
+        self.gemini_mock_profile = None
         
+        if settings.MOCK_PROVIDERS:
+            self._init_mock_clients()
+        else:
+            self._init_clients()
+        
+        # Pre-create per-model client objects so requests never build them
+        for llm_choice in settings.AVAILABLE_LLMS:
+            provider, model = llm_choice.split(":", 1)
+            if provider == "gemini":
+                self._get_gemini_model(model)
+        logger.info(f"Client pool ready with {len(self.gemini_models)} Gemini models")
+    
+    def _init_mock_clients(self):
+        """Serve every provider from in-process fakes for offline load testing"""
+        self.groq_client = MockGroqClient(MockProfile("groq"))
+        self.cohere_client = MockCohereClient(MockProfile("cohere"))
+        self.gemini_mock_profile = MockProfile("gemini")
+        logger.warning("Mock providers enabled - LLM responses are simulated")
+    
+    def _init_clients(self):
+        """Initialize provider clients only if API keys are available"""
         if settings.GROQ_API_KEY:
             try:
                 self.groq_client = Groq(api_key=settings.GROQ_API_KEY)
@@ -39,119 +74,496 @@ class LLMService:
         else:
             logger.warning("Google API key not found")
     
+    def _get_gemini_model(self, model: str) -> Any:
+        """Get the pooled GenerativeModel for a model name, creating it on first use"""
+        model_obj = self.gemini_models.get(model)
+        if model_obj is None:
+            if self.gemini_mock_profile:
+                model_obj = MockGenerativeModel(model, self.gemini_mock_profile)
+            else:
+                model_obj = genai.GenerativeModel(model)
+            self.gemini_models[model] = model_obj
+        return model_obj
+    
+    async def warm_up(self):
+        """Open provider connections ahead of the first request"""
+        if self.gemini_models:
+            try:
+                model_obj = next(iter(self.gemini_models.values()))
+                # All GenerativeModels share one underlying client, so warming one warms them all
+                await asyncio.to_thread(model_obj.count_tokens, "warm up")
+                logger.info("Gemini connection warmed")
+            except Exception as e:
+                logger.warning(f"Gemini warm-up failed: {e}")
+        
+        if self.groq_client:
+            try:
+                await asyncio.to_thread(self.groq_client.models.list)
+                logger.info("Groq connection warmed")
+            except Exception as e:
+                logger.warning(f"Groq warm-up failed: {e}")
+        
+        if self.cohere_client:
+            try:
+                await asyncio.to_thread(self.cohere_client.check_api_key)
+                logger.info("Cohere connection warmed")
+            except Exception as e:
+                logger.warning(f"Cohere warm-up failed: {e}")
+    
     async def generate_response(
         self, 
         llm_choice: str,
         prompt: str,
         images: Optional[List[str]] = None,
         context: Optional[str] = None,
-        document_context: Optional[List[str]] = None
+        document_context: Optional[List[str]] = None,
+        session_id: Optional[str] = None,
+        endpoint: str = "chat",
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        conversation: Optional[str] = None,
+        document_set_version: Optional[str] = None
     ) -> Dict[str, Any]:
+        """Generate a response, sharing one provider call among identical concurrent requests.
+        
+        `context` is retrieved text; `conversation` is the session's summary and recent turns from memory.
+        Requests with document context are only shared when `document_set_version` identifies the selection.
+        Token usage is attributed to the session and endpoint of the call that reached the provider.
+        Very large document context is answered with map-reduce, reporting progress to progress_callback.
+        """
+        def generate():
+            return self._generate_response(
+                llm_choice, prompt, images, context, document_context, session_id, endpoint, progress_callback,
+                conversation
+            )
+        
+        if document_context and document_set_version is None:
+            return await generate()
+        
+        # Documents are keyed by their selection's version, so their text isn't hashed on every turn
+        key = normalize_key(
+            llm_choice,
+            prompt,
+            [img.encode() for img in images or []],
+            context,
+            document_set_version if document_context else None,
+            conversation
+        )
+        return await self.single_flight.do(key, generate)
+    
+    async def _generate_response(
+        self, 
+        llm_choice: str,
+        prompt: str,
+        images: Optional[List[str]] = None,
+        context: Optional[str] = None,
+        document_context: Optional[List[str]] = None,
+        session_id: Optional[str] = None,
+        endpoint: str = "chat",
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        conversation: Optional[str] = None
+    ) -> Dict[str, Any]:
+        document_chars = sum(len(doc) for doc in document_context or [])
+        if settings.MAP_REDUCE_ENABLED and document_chars > settings.MAP_REDUCE_THRESHOLD_CHARS:
+            return await self._generate_map_reduce_response(
+                llm_choice, prompt, images, context, document_context, session_id, endpoint, progress_callback,
+                conversation
+            )
+        
+        full_prompt = self._build_prompt(prompt, context, document_context, conversation)
+        return await self._complete(llm_choice, full_prompt, images, session_id, endpoint)
+    
+    async def stream_response(
+        self,
+        llm_choice: str,
+        prompt: str,
+        images: Optional[List[str]] = None,
+        context: Optional[str] = None,
+        document_context: Optional[List[str]] = None,
+        session_id: Optional[str] = None,
+        endpoint: str = "chat",
+        usage: Optional[Dict[str, Any]] = None,
+        conversation: Optional[str] = None,
+        document_set_version: Optional[str] = None,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> AsyncIterator[str]:
+        """Yield the answer as text deltas while the provider generates it.
+        
+        Image prompts, map-reduce answers and unconfigured providers fall back to one chunk
+        from generate_response, which reports map-reduce progress to progress_callback.
+        Token counts for the call are written into `usage` when given.
+        """
+        provider, model = llm_choice.split(":", 1) if ":" in llm_choice else (llm_choice, "")
+        document_chars = sum(len(doc) for doc in document_context or [])
+        if (
+            images
+            or not self._can_stream(provider)
+            or (settings.MAP_REDUCE_ENABLED and document_chars > settings.MAP_REDUCE_THRESHOLD_CHARS)
+        ):
+            result = await self.generate_response(
+                llm_choice, prompt, images, context, document_context, session_id=session_id, endpoint=endpoint,
+                progress_callback=progress_callback, conversation=conversation, document_set_version=document_set_version
+            )
+            if usage is not None:
+                usage.update(result)
+            yield result["content"]
+            return
         
+        full_prompt = self._build_prompt(prompt, context, document_context or [], conversation)
+        loop = asyncio.get_running_loop()
+        parts = []
+        attempt = 0
+        try:
+            while True:
+                deltas: asyncio.Queue = asyncio.Queue()
+                stop = threading.Event()
+                
+                def produce():
+                    # The SDK stream is a blocking iterator, so it is drained in a worker thread
+                    try:
+                        for delta in self._iter_provider_stream(provider, model, full_prompt):
+                            if stop.is_set():
+                                break
+                            if delta:
+                                loop.call_soon_threadsafe(deltas.put_nowait, delta)
+                        loop.call_soon_threadsafe(deltas.put_nowait, None)
+                    except Exception as e:
+                        loop.call_soon_threadsafe(deltas.put_nowait, e)
+                
+                error = None
+                async with self.rate_limiter.slot(llm_choice):
+                    producer = loop.run_in_executor(None, produce)
+                    try:
+                        while True:
+                            delta = await deltas.get()
+                            if delta is None:
+                                break
+                            if isinstance(delta, Exception):
+                                logger.error(f"LLM stream failed: {delta}")
+                                error = ProviderError.from_exception(provider, delta)
+                                break
+                            parts.append(delta)
+                            yield delta
+                    finally:
+                        # Tell the worker to stop early if the consumer went away
+                        stop.set()
+                await producer
+                
+                if error is None:
+                    break
+                # A rate-limited stream can be retried as long as nothing was sent yet
+                if parts or not error.rate_limited or attempt >= settings.LLM_MAX_RETRIES:
+                    raise error
+                await self._backoff(llm_choice, error, attempt)
+                attempt += 1
+        finally:
+            result = self._build_result("".join(parts), full_prompt, None, None)
+            if parts:
+                self.token_usage.record(
+                    llm_choice,
+                    result["prompt_tokens"],
+                    result["completion_tokens"],
+                    session_id=session_id,
+                    endpoint=endpoint,
+                    estimated=True
+                )
+            if usage is not None:
+                usage.update(result)
+    
+    def _can_stream(self, provider: str) -> bool:
+        if provider == "gemini":
+            return bool(settings.GEMINI_API_KEY or settings.MOCK_PROVIDERS)
+        if provider == "groq":
+            return self.groq_client is not None
+        if provider == "cohere":
+            return self.cohere_client is not None
+        return False
+    
+    def _iter_provider_stream(self, provider: str, model: str, full_prompt: str) -> Iterator[str]:
+        """Blocking iterator over the text deltas of a provider's streaming API"""
+        if provider == "gemini":
+            model_obj = self._get_gemini_model(model or "gemini-1.5-flash")
+            for chunk in model_obj.generate_content(full_prompt, stream=True):
+                yield chunk.text
+        elif provider == "groq":
+            stream = self.groq_client.chat.completions.create(
+                messages=[{"role": "user", "content": full_prompt}],
+                model=self._groq_model_id(model),
+                temperature=0.7,
+                stream=True
+            )
+            for chunk in stream:
+                yield chunk.choices[0].delta.content or ""
+        else:
+            # cohere 4.x streams through chat(stream=True); chat_stream only exists in the v5 SDK
+            for event in self.cohere_client.chat(message=full_prompt, model=model or "command-r-plus", stream=True):
+                if event.event_type == "text-generation":
+                    yield event.text
+    
+    async def _complete(
+        self,
+        llm_choice: str,
+        full_prompt: str,
+        images: Optional[List[str]] = None,
+        session_id: Optional[str] = None,
+        endpoint: str = "chat"
+    ) -> Dict[str, Any]:
+        """Send one fully built prompt to the provider under its rate limit and record token usage"""
         try:
             provider, model = llm_choice.split(":", 1) if ":" in llm_choice else (llm_choice, "")
             
-            if provider == "gemini":
-                return await self._generate_gemini_response(model, prompt, images, context, document_context)
-            elif provider == "groq":
-                return await self._generate_groq_response(model, prompt, context, document_context)
-            elif provider == "cohere":
-                return await self._generate_cohere_response(model, prompt, images, context, document_context)
-            else:
+            if provider not in ("gemini", "groq", "cohere"):
                 return {"content": "Unsupported LLM", "tokens_used": 0}
+            
+            attempt = 0
+            while True:
+                try:
+                    # Wait for a rate-limited provider slot instead of risking a 429
+                    async with self.rate_limiter.slot(llm_choice):
+                        if provider == "gemini":
+                            result = await self._generate_gemini_response(model, full_prompt, images)
+                        elif provider == "groq":
+                            result = await self._generate_groq_response(model, full_prompt)
+                        else:
+                            result = await self._generate_cohere_response(model, full_prompt, images)
+                    break
+                except ProviderError as e:
+                    if not e.rate_limited or attempt >= settings.LLM_MAX_RETRIES:
+                        raise
+                    await self._backoff(llm_choice, e, attempt)
+                    attempt += 1
+            
+            # Only successful provider calls carry usage details
+            if "prompt_tokens" in result:
+                self.token_usage.record(
+                    llm_choice,
+                    result["prompt_tokens"],
+                    result["completion_tokens"],
+                    session_id=session_id,
+                    endpoint=endpoint,
+                    estimated=result["token_source"] != "provider"
+                )
+            return result
+        except (ProviderBusyError, ProviderError):
+            raise
         except Exception as e:
             logger.error(f"LLM response generation failed: {e}")
-            return {"content": f"Error generating response: {str(e)}", "tokens_used": 0}
+            raise ProviderError.from_exception(llm_choice, e) from e
+    
+    @staticmethod
+    async def _backoff(llm_choice: str, error: ProviderError, attempt: int):
+        """Sleep before retrying a rate-limited call, honouring the provider's Retry-After"""
+        delay = error.retry_after or settings.LLM_RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.8, 1.2)
+        delay = min(delay, settings.LLM_RETRY_MAX_DELAY)
+        logger.warning(f"{llm_choice} rate limited the request, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        await asyncio.sleep(delay)
+    
+    async def summarize_conversation(
+        self,
+        llm_choice: str,
+        previous_summary: Optional[str],
+        messages: List[Dict[str, Any]],
+        session_id: Optional[str] = None
+    ) -> Optional[str]:
+        """Fold conversation turns into a running summary; None when the provider call fails"""
+        full_prompt = self._build_summary_prompt(previous_summary, messages)
+        try:
+            result = await self._complete(llm_choice, full_prompt, session_id=session_id, endpoint="memory_summary")
+        except ProviderError:
+            return None
+        if "prompt_tokens" not in result:
+            return None
+        return result["content"].strip() or None
+    
+    async def _generate_map_reduce_response(
+        self,
+        llm_choice: str,
+        prompt: str,
+        images: Optional[List[str]],
+        context: Optional[str],
+        document_context: List[str],
+        session_id: Optional[str],
+        endpoint: str,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]],
+        conversation: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Answer over very large documents: answer per chunk concurrently, then combine the partial answers"""
+        chunks = self._split_documents(document_context)
+        logger.info(f"Map-reduce over {len(chunks)} chunks ({sum(len(doc) for doc in document_context)} characters)")
+        self._report_progress(progress_callback, {"stage": "map", "completed": 0, "total": len(chunks)})
+        
+        # Provider rate limits still apply per call; this only caps how many chunks one request runs at once
+        semaphore = asyncio.Semaphore(settings.MAP_REDUCE_MAX_CONCURRENCY)
+        completed = 0
+        
+        async def map_chunk(index: int, chunk: str) -> Dict[str, Any]:
+            nonlocal completed
+            async with semaphore:
+                try:
+                    result = await self._complete(
+                        llm_choice,
+                        self._build_map_prompt(prompt, chunk, index + 1, len(chunks)),
+                        session_id=session_id,
+                        endpoint=f"{endpoint}:map"
+                    )
+                except (ProviderBusyError, ProviderError) as e:
+                    # One failed chunk doesn't sink the answer; it fails only if every chunk does
+                    result = {"content": "", "tokens_used": 0, "error": e}
+            completed += 1
+            self._report_progress(progress_callback, {"stage": "map", "completed": completed, "total": len(chunks)})
+            return result
+        
+        results = await self._gather_or_cancel([map_chunk(i, chunk) for i, chunk in enumerate(chunks)])
+        calls = list(results)
+        
+        # Provider errors come back without usage details; chunks without relevant content say so explicitly
+        partials = [
+            r["content"].strip() for r in results
+            if "prompt_tokens" in r and r["content"] and "NO RELEVANT INFORMATION" not in r["content"].upper()
+        ]
+        if not any("prompt_tokens" in r for r in results):
+            if "error" in results[0]:
+                raise results[0]["error"]
+            return results[0]
+        
+        # Reduce in rounds until the partial answers fit one final call
+        while len(partials) > 1 and sum(len(p) for p in partials) > settings.MAP_REDUCE_CHUNK_CHARS:
+            groups = self._group_partials(partials)
+            combined = 0
+            self._report_progress(progress_callback, {"stage": "combine", "completed": 0, "total": len(groups)})
+            
+            async def combine_group(group: List[str]) -> Dict[str, Any]:
+                nonlocal combined
+                result = await self._complete(
+                    llm_choice,
+                    self._build_reduce_prompt(prompt, group, None, None, final=False),
+                    session_id=session_id,
+                    endpoint=f"{endpoint}:reduce"
+                )
+                combined += 1
+                self._report_progress(progress_callback, {"stage": "combine", "completed": combined, "total": len(groups)})
+                return result
+            
+            round_results = await self._gather_or_cancel([combine_group(group) for group in groups])
+            calls.extend(round_results)
+            partials = [r["content"].strip() for r in round_results if "prompt_tokens" in r]
+        
+        self._report_progress(progress_callback, {"stage": "reduce", "completed": 0, "total": 1})
+        final = await self._complete(
+            llm_choice,
+            self._build_reduce_prompt(prompt, partials, context, conversation, final=True),
+            images,
+            session_id=session_id,
+            endpoint=f"{endpoint}:reduce"
+        )
+        calls.append(final)
+        self._report_progress(progress_callback, {"stage": "reduce", "completed": 1, "total": 1})
+        
+        # Report the whole request's token cost, not just the final call
+        final["prompt_tokens"] = sum(r.get("prompt_tokens", 0) for r in calls)
+        final["completion_tokens"] = sum(r.get("completion_tokens", 0) for r in calls)
+        final["tokens_used"] = final["prompt_tokens"] + final["completion_tokens"]
+        final["map_reduce_chunks"] = len(chunks)
+        return final
     
-    async def _generate_gemini_response(self, model: str, prompt: str, images: List[str], context: str, document_context: List[str]) -> Dict[str, Any]:
+    @staticmethod
+    async def _gather_or_cancel(coroutines: List[Awaitable[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Run calls concurrently; if one fails the rest are cancelled instead of spending quota on a failed request"""
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
         try:
-            if not settings.GEMINI_API_KEY:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    
+    @staticmethod
+    def _report_progress(progress_callback: Optional[Callable[[Dict[str, Any]], None]], event: Dict[str, Any]):
+        if progress_callback is None:
+            return
+        try:
+            progress_callback(event)
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {e}")
+    
+    async def _generate_gemini_response(self, model: str, full_prompt: str, images: List[str]) -> Dict[str, Any]:
+        try:
+            if not settings.GEMINI_API_KEY and not settings.MOCK_PROVIDERS:
                 return {"content": "Gemini API key not configured", "tokens_used": 0}
             
             # Use gemini-1.5-flash as default if model not specified
             if not model:
                 model = "gemini-1.5-flash"
             
-            full_prompt = self._build_prompt(prompt, context, document_context)
-            
             # For Gemini models that support images
             if images and model in ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-2.0-flash"]:
-                model_obj = genai.GenerativeModel(model)
-                image_parts = []
-                for img_data in images:
-                    try:
-                        image_part = {
-                            "mime_type": "image/jpeg",
-                            "data": base64.b64decode(img_data)
-                        }
-                        image_parts.append(image_part)
-                    except Exception as e:
-                        logger.warning(f"Failed to process image: {e}")
+                model_obj = self._get_gemini_model(model)
+                # Sniff the real format and downsample off the event loop
+                prepared = await asyncio.to_thread(self.image_processor.prepare_many, images, "gemini")
+                image_parts = [{"mime_type": image["mime_type"], "data": image["data"]} for image in prepared]
                 
-                response = model_obj.generate_content([full_prompt] + image_parts)
+                response = await asyncio.to_thread(model_obj.generate_content, [full_prompt] + image_parts)
             else:
-                model_obj = genai.GenerativeModel(model)
-                response = model_obj.generate_content(full_prompt)
+                model_obj = self._get_gemini_model(model)
+                response = await asyncio.to_thread(model_obj.generate_content, full_prompt)
             
-            return {
-                "content": response.text,
-                "tokens_used": len(response.text.split())  # Approximate
-            }
+            usage = getattr(response, "usage_metadata", None)
+            return self._build_result(
+                response.text,
+                full_prompt,
+                self._read_usage(usage, "prompt_token_count"),
+                self._read_usage(usage, "candidates_token_count")
+            )
         except Exception as e:
             logger.error(f"Gemini API error: {e}")
-            return {"content": f"Gemini API error: {str(e)}", "tokens_used": 0}
+            raise ProviderError.from_exception("Gemini", e) from e
     
-    async def _generate_groq_response(self, model: str, prompt: str, context: str, document_context: List[str]) -> Dict[str, Any]:
+    async def _generate_groq_response(self, model: str, full_prompt: str) -> Dict[str, Any]:
         try:
             if not self.groq_client:
                 return {"content": "Groq client not initialized", "tokens_used": 0}
             
-            full_prompt = self._build_prompt(prompt, context, document_context)
+            groq_model = self._groq_model_id(model)
             
-            # Map model names to Groq's model IDs
-            model_map = {
-                "llama-3.1-8b-instant": "llama3-8b-8192",
-                "gemma2-9b-it": "gemma2-9b-it",
-                "mixtral-8x7b-32768": "mixtral-8x7b-32768"
-            }
-            
-            groq_model = model_map.get(model, "llama3-8b-8192")  # Default model
-            
-            response = self.groq_client.chat.completions.create(
+            response = await asyncio.to_thread(
+                self.groq_client.chat.completions.create,
                 messages=[{"role": "user", "content": full_prompt}],
                 model=groq_model,
                 temperature=0.7
             )
             
-            return {
-                "content": response.choices[0].message.content,
-                "tokens_used": response.usage.total_tokens
-            }
+            usage = getattr(response, "usage", None)
+            return self._build_result(
+                response.choices[0].message.content,
+                full_prompt,
+                self._read_usage(usage, "prompt_tokens"),
+                self._read_usage(usage, "completion_tokens")
+            )
         except Exception as e:
             logger.error(f"Groq API error: {e}")
-            return {"content": f"Groq API error: {str(e)}", "tokens_used": 0}
+            raise ProviderError.from_exception("Groq", e) from e
     
-    async def _generate_cohere_response(self, model: str, prompt: str, images: List[str], context: str, document_context: List[str]) -> Dict[str, Any]:
+    async def _generate_cohere_response(self, model: str, full_prompt: str, images: List[str]) -> Dict[str, Any]:
         try:
             if not self.cohere_client:
                 return {"content": "Cohere client not initialized", "tokens_used": 0}
             
-            full_prompt = self._build_prompt(prompt, context, document_context)
-            
             # Cohere vision model handling
             if images and model == "command-a-vision-07-2025":
+                prepared = await asyncio.to_thread(self.image_processor.prepare_many, images, "cohere")
                 image_docs = []
-                for img_data in images:
+                for image in prepared:
                     image_docs.append({
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": img_data
+                            "media_type": image["mime_type"],
+                            "data": image["base64"]
                         }
                     })
                 
-                response = self.cohere_client.chat(
+                response = await asyncio.to_thread(
+                    self.cohere_client.chat,
                     message=full_prompt,
                     model=model,
                     documents=image_docs
@@ -161,20 +573,155 @@ class LLMService:
                 if not model:
                     model = "command-r-plus"
                 
-                response = self.cohere_client.chat(
+                response = await asyncio.to_thread(
+                    self.cohere_client.chat,
                     message=full_prompt,
                     model=model
                 )
             
-            return {
-                "content": response.text,
-                "tokens_used": getattr(response.meta.tokens.usage, 'total_tokens', 0) if hasattr(response, 'meta') else 0
-            }
+            # Cohere reports usage in token_count or meta.billed_units depending on SDK version
+            token_count = getattr(response, "token_count", None)
+            billed_units = self._read_usage(getattr(response, "meta", None), "billed_units")
+            return self._build_result(
+                response.text,
+                full_prompt,
+                self._read_usage(token_count, "prompt_tokens") or self._read_usage(billed_units, "input_tokens"),
+                self._read_usage(token_count, "response_tokens") or self._read_usage(billed_units, "output_tokens")
+            )
         except Exception as e:
             logger.error(f"Cohere API error: {e}")
-            return {"content": f"Cohere API error: {str(e)}", "tokens_used": 0}
+            raise ProviderError.from_exception("Cohere", e) from e
+    
+    @staticmethod
+    def _groq_model_id(model: str) -> str:
+        """Map model names to Groq's model IDs"""
+        model_map = {
+            "llama-3.1-8b-instant": "llama3-8b-8192",
+            "gemma2-9b-it": "gemma2-9b-it",
+            "mixtral-8x7b-32768": "mixtral-8x7b-32768"
+        }
+        return model_map.get(model, "llama3-8b-8192")  # Default model
+    
+    @staticmethod
+    def _read_usage(usage: Any, field: str) -> Any:
+        """Read a usage field from an SDK object or dict, returning None when absent"""
+        if usage is None:
+            return None
+        if isinstance(usage, dict):
+            return usage.get(field)
+        return getattr(usage, field, None)
+    
+    def _build_result(self, content: str, full_prompt: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Dict[str, Any]:
+        """Build a response dict, counting tokens locally when the provider did not report them"""
+        token_source = "provider"
+        if not prompt_tokens or completion_tokens is None:
+            token_source = "estimated"
+            prompt_tokens = prompt_tokens or count_tokens(full_prompt)
+            completion_tokens = completion_tokens if completion_tokens is not None else count_tokens(content)
+        
+        return {
+            "content": content,
+            "tokens_used": int(prompt_tokens) + int(completion_tokens),
+            "prompt_tokens": int(prompt_tokens),
+            "completion_tokens": int(completion_tokens),
+            "token_source": token_source
+        }
     
-    def _build_prompt(self, prompt: str, context: str, document_context: List[str]) -> str:
+    def _split_documents(self, document_context: List[str]) -> List[str]:
+        """Split documents into overlapping chunks, preferring paragraph or line boundaries"""
+        size = settings.MAP_REDUCE_CHUNK_CHARS
+        overlap = settings.MAP_REDUCE_CHUNK_OVERLAP
+        chunks = []
+        for doc_number, doc in enumerate(document_context, 1):
+            start = 0
+            while start < len(doc):
+                end = min(start + size, len(doc))
+                if end < len(doc):
+                    boundary = doc.rfind("\n\n", start + size // 2, end)
+                    if boundary < 0:
+                        boundary = doc.rfind("\n", start + size // 2, end)
+                    if boundary > start:
+                        end = boundary
+                chunks.append(f"[Document {doc_number}, characters {start}-{end}]\n{doc[start:end]}")
+                if end >= len(doc):
+                    break
+                start = max(end - overlap, start + 1)
+        return chunks
+    
+    @staticmethod
+    def _group_partials(partials: List[str]) -> List[List[str]]:
+        """Group partial answers so each group fits in one reduce call"""
+        groups, current, current_size = [], [], 0
+        for partial in partials:
+            if current and current_size + len(partial) > settings.MAP_REDUCE_CHUNK_CHARS:
+                groups.append(current)
+                current, current_size = [], 0
+            current.append(partial)
+            current_size += len(partial)
+        if current:
+            groups.append(current)
+        # Always make progress, even if every partial is oversized
+        if len(groups) == len(partials) and len(groups) > 1:
+            groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+        return groups
+    
+    def _build_map_prompt(self, prompt: str, chunk: str, index: int, total: int) -> str:
+        """Build the per-chunk prompt for map-reduce"""
+        return "\n".join([
+            f"DOCUMENT EXCERPT ({index} of {total}):",
+            chunk,
+            "",
+            f"USER QUESTION: {prompt}",
+            "",
+            "Using only this excerpt, extract the facts that help answer the question and answer as far as the "
+            "excerpt allows. If the excerpt contains nothing relevant, reply exactly: NO RELEVANT INFORMATION"
+        ])
+    
+    def _build_reduce_prompt(self, prompt: str, partials: List[str], context: Optional[str],
+                             conversation: Optional[str], final: bool) -> str:
+        """Build the prompt that combines partial answers from document chunks"""
+        prompt_parts = ["PARTIAL ANSWERS FROM DOCUMENT SECTIONS:"]
+        for i, partial in enumerate(partials, 1):
+            prompt_parts.append(f"Section {i}: {partial}")
+        prompt_parts.append("")
+        
+        if conversation:
+            prompt_parts.append(f"CONVERSATION HISTORY:\n{conversation}")
+            prompt_parts.append("")
+        
+        if context:
+            prompt_parts.append(f"RETRIEVED CONTEXT:\n{context}")
+            prompt_parts.append("")
+        
+        prompt_parts.append(f"USER QUESTION: {prompt}")
+        prompt_parts.append("")
+        if final:
+            prompt_parts.append("Combine the partial answers into one complete, consistent response to the question. "
+                                "If none of the sections were relevant, say that the documents do not cover it.")
+        else:
+            prompt_parts.append("Merge these partial answers into one concise set of findings, keeping every relevant fact.")
+        
+        return "\n".join(prompt_parts)
+    
+    def _build_summary_prompt(self, previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> str:
+        """Build the prompt that extends a conversation summary with newer turns"""
+        prompt_parts = []
+        if previous_summary:
+            prompt_parts.append(f"CURRENT SUMMARY:\n{previous_summary}")
+            prompt_parts.append("")
+        
+        prompt_parts.append("NEW CONVERSATION TURNS:")
+        for msg in messages:
+            role = "User" if msg["role"] == "user" else "Assistant"
+            prompt_parts.append(f"{role}: {msg['content']}")
+        prompt_parts.append("")
+        prompt_parts.append(f"Update the summary to include the new turns in at most {settings.MEMORY_SUMMARY_MAX_WORDS} words. "
+                            "Keep the user's goals, facts and decisions, names, numbers and open questions; drop "
+                            "pleasantries. Reply with the summary only.")
+        
+        return "\n".join(prompt_parts)
+    
+    def _build_prompt(self, prompt: str, context: str, document_context: List[str], conversation: Optional[str] = None) -> str:
         """Build enhanced prompt with context and document information"""
         prompt_parts = []
         
@@ -184,8 +731,12 @@ class LLMService:
                 prompt_parts.append(f"Document {i}: {doc}")
             prompt_parts.append("")
         
+        if conversation:
+            prompt_parts.append(f"CONVERSATION HISTORY:\n{conversation}")
+            prompt_parts.append("")
+        
         if context:
-            prompt_parts.append(f"CONVERSATION CONTEXT:\n{context}")
+            prompt_parts.append(f"RETRIEVED CONTEXT:\n{context}")
             prompt_parts.append("")
         
         prompt_parts.append(f"USER QUESTION: {prompt}")
@@ -198,30 +749,93 @@ class LLMService:
 class InternetSearchService:
     def __init__(self):
         self.api_key = settings.SERPER_API_KEY
-        if self.api_key:
+        self.single_flight = SingleFlight("search")
+        self.cache = TTLCache(
+            maxsize=settings.SEARCH_CACHE_MAX_ENTRIES,
+            ttl=settings.SEARCH_CACHE_TTL,
+            stale_ttl=settings.SEARCH_CACHE_STALE_TTL
+        )
+        # Pooled keep-alive client, created on first use so it binds to the running event loop
+        self.client: Optional[httpx.AsyncClient] = None
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        self.mock_serper = None
+        if settings.MOCK_PROVIDERS:
+            self.mock_serper = MockSerper(MockProfile("serper", latency_ms=settings.MOCK_SEARCH_LATENCY_MS))
+            logger.warning("Mock providers enabled - internet search results are simulated")
+        elif self.api_key:
             logger.info("Serper API key found - internet search enabled")
         else:
             logger.warning("Serper API key not found - internet search disabled")
     
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url="https://google.serper.dev",
+                headers={
+                    'X-API-KEY': self.api_key,
+                    'Content-Type': 'application/json'
+                },
+                timeout=httpx.Timeout(settings.SEARCH_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=settings.SEARCH_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.SEARCH_MAX_CONNECTIONS,
+                    keepalive_expiry=60.0
+                ),
+                transport=self.mock_serper.transport() if self.mock_serper else None
+            )
+        return self.client
+    
+    async def aclose(self):
+        """Close pooled connections and stop background refreshes"""
+        for task in list(self._refresh_tasks):
+            task.cancel()
+        if self.client is not None:
+            await self.client.aclose()
+    
     async def search(self, query: str) -> List[Dict[str, Any]]:
+        """Perform internet search, served from cache when possible.
+        
+        Popular queries past their TTL are answered from the stale entry while one
+        background request refreshes it; identical concurrent misses share one Serper call.
+        """
+        key = normalize_key(query)
+        entry = self.cache.get(key, allow_stale=True)
+        if entry is not None:
+            if not entry.stale:
+                return copy.deepcopy(entry.value)
+            if entry.hits >= settings.SEARCH_CACHE_POPULAR_HITS:
+                self._schedule_refresh(key, query)
+                return copy.deepcopy(entry.value)
+        
+        results = await self.single_flight.do(key, lambda: self._fetch(key, query))
+        return copy.deepcopy(results)
+    
+    def _schedule_refresh(self, key: str, query: str):
+        task = asyncio.create_task(self.single_flight.do(key, lambda: self._fetch(key, query)))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+    
+    async def _fetch(self, key: str, query: str) -> List[Dict[str, Any]]:
+        results = await self._search(query)
+        # Failed searches return no results and are not cached
+        if results:
+            self.cache.set(key, results)
+        return results
+    
+    async def _search(self, query: str) -> List[Dict[str, Any]]:
         """Perform internet search using Serper API"""
-        if not self.api_key:
+        if not self.api_key and not self.mock_serper:
             logger.warning("Internet search disabled - no Serper API key")
             return []
         
         try:
-            url = "https://google.serper.dev/search"
             payload = {
                 "q": query,
                 "num": 5  # Number of results
             }
-            headers = {
-                'X-API-KEY': self.api_key,
-                'Content-Type': 'application/json'
-            }
             
             logger.info(f"Performing internet search for: {query}")
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
+            response = await self._get_client().post("/search", json=payload)
             response.raise_for_status()
             results = response.json()
             
@@ -239,10 +853,10 @@ class InternetSearchService:
             logger.info(f"Internet search returned {len(search_results)} results")
             return search_results
             
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             logger.error("Internet search timeout")
             return []
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Internet search error: {e}")
             return []
         except Exception as e:
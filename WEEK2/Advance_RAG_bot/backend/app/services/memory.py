@@ -1,61 +1,167 @@
-from typing import List, Dict, Any, Optional
-from collections import deque
+from typing import List, Dict, Any, Awaitable, Callable, Optional, Set, Tuple
 import json
 import time
+import asyncio
 import logging
 import hashlib
+import threading
+import numpy as np
+from config import settings
+from services.embeddings import get_encoder
+from services.session_store import Session, SessionStore, create_session_store
+from services.token_usage import count_tokens
 
 logger = logging.getLogger(__name__)
 
+# Characters of a turn that are embedded; the encoder truncates longer input anyway
+RECALL_EMBED_CHARS = 2000
+# Without a persistent store the index keeps each turn's text itself, cut to this many characters per message
+RECALL_TEXT_CHARS = 1000
+
+
+class TurnIndex:
+    """Normalized embeddings of one session's question-and-answer turns in a growable float16 matrix.
+    
+    Turns hold the message row ids and timestamps; their text is read back from the session store when recalled.
+    """
+
+    def __init__(self, dim: int, max_turns: int):
+        self.max_turns = max_turns
+        self.vectors = np.empty((min(16, max_turns), dim), dtype=np.float16)
+        self.turns: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, vector: np.ndarray, turn: Dict[str, Any]):
+        with self._lock:
+            if len(self.turns) >= self.max_turns:
+                # Drop the oldest quarter at once so trimming stays rare
+                drop = max(1, self.max_turns // 4)
+                self.vectors[:len(self.turns) - drop] = self.vectors[drop:len(self.turns)]
+                del self.turns[:drop]
+            if len(self.turns) == len(self.vectors):
+                grown = np.empty((min(len(self.vectors) * 2, self.max_turns), self.vectors.shape[1]), dtype=np.float16)
+                grown[:len(self.turns)] = self.vectors[:len(self.turns)]
+                self.vectors = grown
+            self.vectors[len(self.turns)] = vector
+            self.turns.append(turn)
+
+    def search(self, query: np.ndarray, before: float, top_k: int, min_similarity: float) -> List[Tuple[float, Dict[str, Any]]]:
+        """Most similar turns that ended before `before`, best first"""
+        with self._lock:
+            count = len(self.turns)
+            if count == 0:
+                return []
+            scores = self.vectors[:count].astype(np.float32) @ query
+            turns = list(self.turns)
+        eligible = [i for i in np.argsort(-scores) if scores[i] >= min_similarity and turns[i]["end_timestamp"] < before]
+        return [(float(scores[i]), turns[i]) for i in eligible[:top_k]]
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+
 class ConversationMemory:
-    def __init__(self, max_messages: int = 10):
-        self.memories: Dict[str, deque] = {}
+    def __init__(
+        self,
+        max_messages: int = 10,
+        store: Optional[SessionStore] = None,
+        document_resolver: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+        summarizer: Optional[Callable[[Optional[str], List[Dict[str, Any]], str], Awaitable[Optional[str]]]] = None
+    ):
         self.max_messages = max_messages
-        self.conversation_summaries: Dict[str, str] = {}
-        self.context_embeddings: Dict[str, List[float]] = {}
+        # Messages and summaries live in a bounded session store, persisted and shared across workers
+        self.store = store or create_session_store(max_messages)
+        # Messages only reference documents; their text is looked up when a context string is built
+        self.document_resolver = document_resolver
+        # Async (previous summary, new messages, session ID) -> updated summary, run in the background
+        self.summarizer = summarizer
+        self.recent_messages = settings.MEMORY_RECENT_MESSAGES
+        self._summarizing: Set[str] = set()
+        self._summary_tasks: Set[asyncio.Task] = set()
+        self.summaries_generated = 0
+        self.summaries_failed = 0
+        # Each turn is embedded once in the background; the vectors live on the cached session
+        self.recall_enabled = settings.MEMORY_RECALL_ENABLED
+        self._embedding_tasks: Set[asyncio.Task] = set()
+        self.turns_embedded = 0
+        self.embedding_failures = 0
+        self.recalled_turns = 0
         self.logger = logging.getLogger(__name__)
     
-    def add_message(self, session_id: str, role: str, content: str, document_context: List[str] = None):
+    def add_message(self, session_id: str, role: str, content: str, document_refs: List[Dict[str, Any]] = None):
         """Add a message to conversation memory with enhanced context tracking"""
-        if session_id not in self.memories:
-            self.memories[session_id] = deque(maxlen=self.max_messages)
-        
+        session, message = self._append_message(session_id, role, content, document_refs)
+        self._schedule_summary(session_id, session)
+        self._schedule_embedding(session, message)
+    
+    async def add_message_async(self, session_id: str, role: str, content: str, document_refs: List[Dict[str, Any]] = None):
+        """add_message for the event loop: the store write runs in a worker thread, background work starts here"""
+        session, message = await asyncio.to_thread(self._append_message, session_id, role, content, document_refs)
+        self._schedule_summary(session_id, session)
+        self._schedule_embedding(session, message)
+    
+    def _append_message(self, session_id: str, role: str, content: str,
+                        document_refs: Optional[List[Dict[str, Any]]]) -> Tuple[Session, Dict[str, Any]]:
         # Create message with enhanced metadata
         message = {
             "role": role,
             "content": content,
             "timestamp": time.time(),
-            "document_context": document_context if document_context else [],
+            "document_refs": document_refs if document_refs else [],
             "message_id": self._generate_message_id(content, role),
-            "context_hash": self._generate_context_hash(content, document_context)
+            "context_hash": self._generate_context_hash(content, document_refs)
         }
         
-        self.memories[session_id].append(message)
-        
-        # Update conversation summary if we have enough messages
-        if len(self.memories[session_id]) >= 3:
-            self._update_conversation_summary(session_id)
-        
-        self.logger.info(f"Added {role} message to memory for session {session_id} (total: {len(self.memories[session_id])})")
+        session = self.store.append(session_id, message)
+        self.logger.info(f"Added {role} message to memory for session {session_id} (total: {len(session.messages)})")
+        return session, message
     
     def get_conversation_history(self, session_id: str) -> List[Dict[str, Any]]:
         """Get conversation history for a session"""
-        if session_id not in self.memories:
+        session = self.store.get(session_id)
+        if session is None:
             return []
-        return list(self.memories[session_id])
+        return list(session.messages)
+    
+    def get_last_question(self, session_id: str) -> Optional[str]:
+        """The session's latest user message, if any; reads the session store, so call it off the event loop"""
+        session = self.store.get(session_id)
+        if session is None:
+            return None
+        return next((msg["content"] for msg in reversed(session.messages) if msg["role"] == "user"), None)
     
-    def get_context_string(self, session_id: str, max_messages: int = 5) -> str:
-        """Get enhanced conversation context as a string for LLM prompting"""
-        history = self.get_conversation_history(session_id)
+    def get_context_string(self, session_id: str, max_messages: Optional[int] = None, query: Optional[str] = None) -> str:
+        """Get enhanced conversation context as a string for LLM prompting.
+        
+        Holds the rolling summary, earlier turns most similar to `query` (when given) and the recent turns.
+        Recall encodes the query, so call it off the event loop.
+        """
+        session = self.store.get(session_id)
+        if session is None:
+            return ""
+        max_messages = max_messages or self.recent_messages
         context_parts = []
         
         # Add conversation summary if available
-        if session_id in self.conversation_summaries:
-            context_parts.append(f"CONVERSATION SUMMARY: {self.conversation_summaries[session_id]}")
+        if session.summary:
+            context_parts.append(f"CONVERSATION SUMMARY: {session.summary}")
             context_parts.append("")
         
         # Get last N messages for context with enhanced formatting
-        recent_messages = history[-max_messages:]
+        recent_messages = list(session.messages)[-max_messages:]
+        
+        # Earlier turns relevant to the question, within a fixed token budget
+        if query and recent_messages:
+            recalled = self._recall_turns(session_id, session, query, before=recent_messages[0]["timestamp"])
+            if recalled:
+                context_parts.append("RELEVANT EARLIER TURNS:")
+                for turn in recalled:
+                    timestamp = time.strftime("%H:%M", time.localtime(turn["timestamp"]))
+                    context_parts.append(f"[{timestamp}] User: {turn['user']}")
+                    context_parts.append(f"[{timestamp}] Assistant: {turn['assistant']}")
+                context_parts.append("")
+                context_parts.append("RECENT CONVERSATION:")
+        
         for i, msg in enumerate(recent_messages):
             role = "User" if msg["role"] == "user" else "Assistant"
             timestamp = time.strftime("%H:%M", time.localtime(msg["timestamp"]))
@@ -65,9 +171,10 @@ class ConversationMemory:
             context_parts.append(message_text)
             
             # Include document context if available
-            if msg.get("document_context") and msg["document_context"]:
-                doc_refs = [doc[:100] + "..." if len(doc) > 100 else doc for doc in msg["document_context"]]
-                context_parts.append(f"  📄 Document References: {'; '.join(doc_refs)}")
+            if msg.get("document_refs"):
+                doc_refs = self._resolve_document_refs(msg["document_refs"])
+                if doc_refs:
+                    context_parts.append(f"  📄 Document References: {'; '.join(doc_refs)}")
             
             # Add message ID for tracking
             if msg.get("message_id"):
@@ -77,19 +184,17 @@ class ConversationMemory:
     
     def clear_memory(self, session_id: str):
         """Clear memory for a specific session"""
-        if session_id in self.memories:
-            del self.memories[session_id]
-            logger.info(f"Cleared memory for session {session_id}")
+        self.store.delete(session_id)
+        logger.info(f"Cleared memory for session {session_id}")
     
     def get_session_count(self, session_id: str) -> int:
         """Get number of messages in a session"""
-        if session_id in self.memories:
-            return len(self.memories[session_id])
-        return 0
+        session = self.store.get(session_id)
+        return len(session.messages) if session else 0
     
     def get_all_sessions(self) -> List[str]:
         """Get list of all active session IDs"""
-        return list(self.memories.keys())
+        return self.store.session_ids()
     
     def _generate_message_id(self, content: str, role: str) -> str:
         """Generate unique message ID"""
@@ -97,56 +202,200 @@ class ConversationMemory:
         timestamp = str(int(time.time()))[-6:]
         return f"{role}_{timestamp}_{content_hash}"
     
-    def _generate_context_hash(self, content: str, document_context: List[str]) -> str:
-        """Generate hash for context tracking"""
-        context_str = content + "|" + "|".join(document_context or [])
+    def _generate_context_hash(self, content: str, document_refs: List[Dict[str, Any]]) -> str:
+        """Generate hash for context tracking from the message and the document spans it refers to"""
+        refs = [f"{ref['document_id']}:{ref['start']}-{ref['end']}" for ref in document_refs or []]
+        context_str = content + "|" + "|".join(refs)
         return hashlib.md5(context_str.encode()).hexdigest()[:12]
     
-    def _update_conversation_summary(self, session_id: str):
-        """Update conversation summary based on recent messages"""
-        if session_id not in self.memories:
+    def _resolve_document_refs(self, document_refs: List[Dict[str, Any]]) -> List[str]:
+        """Excerpts for document references, skipping documents that no longer exist"""
+        if self.document_resolver is None:
+            return [ref["document_id"] for ref in document_refs]
+        excerpts = []
+        for ref in document_refs:
+            text = self.document_resolver(ref)
+            if text is not None:
+                excerpts.append(text + "..." if ref["end"] < ref.get("length", ref["end"]) else text)
+        return excerpts
+    
+    def _schedule_summary(self, session_id: str, session: Session):
+        """Start a background summary once enough older turns are not covered by the current one"""
+        if self.summarizer is None or session_id in self._summarizing:
+            return
+        messages = list(session.messages)
+        older = messages[:-self.recent_messages] if self.recent_messages else messages
+        pending = [msg for msg in older if msg["timestamp"] > session.summarized_until]
+        if not pending:
             return
         
-        messages = list(self.memories[session_id])
-        if len(messages) < 3:
+        # Below the token threshold, summarize only when an unsummarized message is next to drop out of the window
+        about_to_drop = len(messages) == session.messages.maxlen and pending[0] is messages[0]
+        pending_tokens = sum(count_tokens(msg["content"]) for msg in pending)
+        if pending_tokens < settings.MEMORY_SUMMARY_TRIGGER_TOKENS and not about_to_drop:
             return
         
-        # Extract key topics and themes from recent messages
-        topics = []
-        for msg in messages[-5:]:  # Last 5 messages
-            content = msg["content"].lower()
-            if "question" in content or "?" in content:
-                topics.append("questioning")
-            if "help" in content or "assist" in content:
-                topics.append("assistance")
-            if "document" in content or "file" in content:
-                topics.append("document_analysis")
-            if "search" in content or "find" in content:
-                topics.append("search")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Outside the server's event loop (scripts); the next turn will try again
+            return
+        self._summarizing.add(session_id)
+        task = loop.create_task(self._summarize(session_id, session.summary, pending))
+        self._summary_tasks.add(task)
+        task.add_done_callback(self._summary_tasks.discard)
+    
+    async def _summarize(self, session_id: str, previous_summary: Optional[str], messages: List[Dict[str, Any]]):
+        """Fold `messages` into the session summary without holding up the chat request"""
+        try:
+            summary = await self.summarizer(previous_summary, messages, session_id)
+            if summary is None:
+                self.summaries_failed += 1
+                return
+            if await asyncio.to_thread(self._store_summary, session_id, summary, messages[-1]["timestamp"]):
+                self.summaries_generated += 1
+        except Exception as e:
+            self.summaries_failed += 1
+            self.logger.warning(f"Conversation summary for session {session_id} failed: {e}")
+        finally:
+            self._summarizing.discard(session_id)
+    
+    def _store_summary(self, session_id: str, summary: str, summarized_until: float) -> bool:
+        """Save a finished summary unless the session was cleared meanwhile"""
+        if self.store.get(session_id) is None:
+            return False
+        self.store.set_summary(session_id, summary, summarized_until)
+        return True
+    
+    def _schedule_embedding(self, session: Session, message: Dict[str, Any]):
+        """Once a question is answered, embed the pair in a worker thread and add it to the recall index"""
+        if not self.recall_enabled or message["role"] == "user":
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._embed_turn(session, message))
+        self._embedding_tasks.add(task)
+        task.add_done_callback(self._embedding_tasks.discard)
+    
+    async def _embed_turn(self, session: Session, message: Dict[str, Any]):
+        try:
+            embedded = await asyncio.to_thread(self._encode_turn, session, message)
+        except Exception as e:
+            self.embedding_failures += 1
+            if self.embedding_failures == 1:
+                self.logger.warning(f"Turn embedding failed, earlier turns won't be recalled: {e}")
+            return
+        if embedded is None:
+            return
+        
+        vector, turn = embedded
+        if session.context_embeddings is None:
+            session.context_embeddings = TurnIndex(len(vector), settings.MEMORY_RECALL_MAX_TURNS)
+        session.context_embeddings.add(vector, turn)
+        self.turns_embedded += 1
+    
+    def _encode_turn(self, session: Session, message: Dict[str, Any]) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        """Embedding of an answer together with the question before it, and the turn to index it under"""
+        rows = self.store.rows(session)
+        position = next(
+            (i for i in range(len(rows) - 1, 0, -1) if rows[i][1].get("message_id") == message["message_id"]), None
+        )
+        if position is None or rows[position - 1][1]["role"] != "user":
+            return None
+        (question_row, question), (answer_row, answer) = rows[position - 1], rows[position]
+        
+        turn = {
+            "rows": (question_row, answer_row),
+            "timestamp": question["timestamp"],
+            "end_timestamp": answer["timestamp"]
+        }
+        if question_row is None or answer_row is None:
+            turn["text"] = (question["content"][:RECALL_TEXT_CHARS], answer["content"][:RECALL_TEXT_CHARS])
+        text = f"User: {question['content']}\nAssistant: {answer['content']}"[:RECALL_EMBED_CHARS]
+        vectors = get_encoder().encode([text], normalize_embeddings=True)
+        return np.asarray(vectors[0], dtype=np.float32), turn
+    
+    def _recall_turns(self, session_id: str, session: Session, query: str, before: float) -> List[Dict[str, Any]]:
+        """Earlier turns most similar to the query that fit the recall token budget, oldest first"""
+        index = session.context_embeddings
+        if not self.recall_enabled or index is None or not len(index):
+            return []
+        try:
+            query_vector = np.asarray(get_encoder().encode_query(query)[0], dtype=np.float32)
+        except Exception as e:
+            self.logger.warning(f"Query embedding for recall failed: {e}")
+            return []
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return []
         
-        # Create summary
-        unique_topics = list(set(topics))
-        if unique_topics:
-            self.conversation_summaries[session_id] = f"Recent conversation topics: {', '.join(unique_topics)}"
-        else:
-            self.conversation_summaries[session_id] = "General conversation in progress"
+        matches = index.search(
+            query_vector / norm,
+            before=before,
+            top_k=settings.MEMORY_RECALL_TOP_K,
+            min_similarity=settings.MEMORY_RECALL_MIN_SIMILARITY
+        )
+        # One lookup loads the text of every matched turn the index doesn't hold itself
+        row_ids = [row_id for _, turn in matches if "text" not in turn for row_id in turn["rows"]]
+        stored = self.store.get_messages(session_id, row_ids)
+        
+        recalled = []
+        budget = settings.MEMORY_RECALL_TOKEN_BUDGET
+        for _, turn in matches:
+            if "text" in turn:
+                user, assistant = turn["text"]
+            elif all(row_id in stored for row_id in turn["rows"]):
+                user, assistant = (stored[row_id]["content"] for row_id in turn["rows"])
+            else:
+                continue
+            tokens = count_tokens(user) + count_tokens(assistant)
+            if tokens <= budget:
+                recalled.append({"user": user, "assistant": assistant, "timestamp": turn["timestamp"]})
+                budget -= tokens
+        self.recalled_turns += len(recalled)
+        return sorted(recalled, key=lambda turn: turn["timestamp"])
     
     def get_conversation_summary(self, session_id: str) -> str:
         """Get conversation summary for a session"""
-        return self.conversation_summaries.get(session_id, "No summary available")
+        session = self.store.get(session_id)
+        return session.summary if session and session.summary else "No summary available"
     
     def get_memory_stats(self, session_id: str) -> Dict[str, Any]:
         """Get memory statistics for a session"""
-        if session_id not in self.memories:
+        session = self.store.get(session_id)
+        if session is None:
             return {"message_count": 0, "has_summary": False, "context_hashes": []}
         
-        messages = list(self.memories[session_id])
+        messages = list(session.messages)
         context_hashes = [msg.get("context_hash", "") for msg in messages if msg.get("context_hash")]
         
         return {
             "message_count": len(messages),
-            "has_summary": session_id in self.conversation_summaries,
+            "has_summary": bool(session.summary),
             "context_hashes": context_hashes,
-            "summary": self.conversation_summaries.get(session_id, ""),
+            "summary": session.summary or "",
+            "summarized_until": session.summarized_until or None,
+            "embedded_turns": len(session.context_embeddings) if session.context_embeddings is not None else 0,
             "last_message_time": messages[-1]["timestamp"] if messages else None
-        }
\ No newline at end of file
+        }
+    
+    def get_summary_stats(self) -> Dict[str, Any]:
+        """Background summarizer statistics"""
+        return {
+            "enabled": self.summarizer is not None,
+            "in_progress": len(self._summarizing),
+            "generated": self.summaries_generated,
+            "failed": self.summaries_failed
+        }
+    
+    def get_recall_stats(self) -> Dict[str, Any]:
+        """Turn embedding and semantic recall statistics"""
+        return {
+            "enabled": self.recall_enabled,
+            "turns_embedded": self.turns_embedded,
+            "embedding_failures": self.embedding_failures,
+            "embeddings_in_progress": len(self._embedding_tasks),
+            "recalled_turns": self.recalled_turns
+        }
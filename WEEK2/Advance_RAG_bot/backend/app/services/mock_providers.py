@@ -0,0 +1,227 @@
+"""
+In-process stand-ins for the Gemini, Groq, Cohere and Serper clients.
+
+Enabled with settings.MOCK_PROVIDERS so the backend can be load-tested and benchmarked
+offline. Each fake mirrors the subset of its SDK surface that LLMService and
+InternetSearchService use, with configurable latency, token rate, streaming and
+error injection.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+import httpx
+from config import settings
+from services.token_usage import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_FILLER_WORDS = [
+    "the", "document", "describes", "relevant", "details", "and", "this", "answer",
+    "summarizes", "key", "points", "from", "the", "available", "context", "for", "you"
+]
+
+
+class MockProviderError(Exception):
+    """Injected provider failure"""
+
+    def __init__(self, provider: str, status_code: int):
+        self.status_code = status_code
+        super().__init__(f"Mock {provider} error (HTTP {status_code})")
+
+
+class MockProfile:
+    """Latency, token-rate and error settings shared by the mock providers"""
+
+    def __init__(self, provider: str, latency_ms: Optional[float] = None, seed: Optional[int] = None):
+        self.provider = provider
+        self.distribution = settings.MOCK_LATENCY_DISTRIBUTION
+        self.latency_ms = settings.MOCK_LATENCY_MS if latency_ms is None else latency_ms
+        self.jitter_ms = settings.MOCK_LATENCY_JITTER_MS
+        self.tokens_per_second = settings.MOCK_TOKENS_PER_SECOND
+        self.response_tokens = settings.MOCK_RESPONSE_TOKENS
+        self.error_rate = settings.MOCK_ERROR_RATE
+        self.error_status = settings.MOCK_ERROR_STATUS
+        seed = settings.MOCK_SEED if seed is None else seed
+        # Seed per provider so each fake replays the same sequence run to run
+        self._random = random.Random(f"{seed}:{provider}" if seed is not None else None)
+        self._lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        """Sample time to first token in seconds"""
+        with self._lock:
+            mean, jitter = self.latency_ms, self.jitter_ms
+            if self.distribution == "fixed" or jitter <= 0:
+                value = mean
+            elif self.distribution == "uniform":
+                value = self._random.uniform(mean - jitter, mean + jitter)
+            elif self.distribution == "normal":
+                value = self._random.gauss(mean, jitter)
+            else:
+                # Lognormal with the configured mean and standard deviation gives a realistic long tail
+                sigma2 = math.log(1 + (jitter / mean) ** 2) if mean > 0 else 0.0
+                mu = math.log(mean) - sigma2 / 2 if mean > 0 else 0.0
+                value = self._random.lognormvariate(mu, math.sqrt(sigma2))
+        return max(value, 0.0) / 1000
+
+    def maybe_fail(self):
+        with self._lock:
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+        if failed:
+            raise MockProviderError(self.provider, self.error_status)
+
+    def token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def build_tokens(self, prompt: str) -> List[str]:
+        """Deterministic response tokens derived from the prompt"""
+        question = prompt.rsplit("USER QUESTION:", 1)[-1].strip().split("\n", 1)[0][:80]
+        filler = random.Random(hashlib.md5(prompt.encode()).hexdigest())
+        tokens = f"[mock {self.provider}] Answer to: {question}.".split()
+        while len(tokens) < self.response_tokens:
+            tokens.append(filler.choice(_FILLER_WORDS))
+        return [token + " " for token in tokens[:max(self.response_tokens, 1)]]
+
+    def complete(self, prompt: str) -> str:
+        """Block like a non-streaming SDK call and return the full response text"""
+        self.maybe_fail()
+        tokens = self.build_tokens(prompt)
+        time.sleep(self.sample_latency() + len(tokens) * self.token_delay())
+        return "".join(tokens).strip()
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield response tokens at the configured token rate"""
+        self.maybe_fail()
+        tokens = self.build_tokens(prompt)
+        time.sleep(self.sample_latency())
+        for token in tokens:
+            time.sleep(self.token_delay())
+            yield token
+
+
+def _prompt_text(contents: Any) -> str:
+    if isinstance(contents, list):
+        return " ".join(part for part in contents if isinstance(part, str))
+    return str(contents)
+
+
+class MockGenerativeModel:
+    """Stand-in for google.generativeai.GenerativeModel"""
+
+    def __init__(self, model_name: str, profile: MockProfile):
+        self.model_name = model_name
+        self.profile = profile
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs):
+        prompt = _prompt_text(contents)
+        if stream:
+            return (SimpleNamespace(text=token) for token in self.profile.stream(prompt))
+        text = self.profile.complete(prompt)
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=count_tokens(prompt),
+                candidates_token_count=count_tokens(text)
+            )
+        )
+
+    def count_tokens(self, contents: Any):
+        return SimpleNamespace(total_tokens=count_tokens(_prompt_text(contents)))
+
+
+class MockGroqClient:
+    """Stand-in for groq.Groq"""
+
+    def __init__(self, profile: MockProfile):
+        self.profile = profile
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=lambda: SimpleNamespace(data=[]))
+
+    def _create(self, messages: List[Dict[str, str]], model: str, stream: bool = False, **kwargs):
+        prompt = "\n".join(message.get("content", "") for message in messages)
+        if stream:
+            return (
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+                for token in self.profile.stream(prompt)
+            )
+        text = self.profile.complete(prompt)
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(text)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+        )
+
+
+class MockCohereClient:
+    """Stand-in for cohere.Client"""
+
+    def __init__(self, profile: MockProfile):
+        self.profile = profile
+
+    def chat(self, message: str, model: str = None, documents: List[Dict[str, Any]] = None, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream(message)
+        text = self.profile.complete(message)
+        prompt_tokens, response_tokens = count_tokens(message), count_tokens(text)
+        return SimpleNamespace(
+            text=text,
+            token_count={
+                "prompt_tokens": prompt_tokens,
+                "response_tokens": response_tokens,
+                "total_tokens": prompt_tokens + response_tokens
+            },
+            meta={"billed_units": {"input_tokens": prompt_tokens, "output_tokens": response_tokens}}
+        )
+
+    def _stream(self, message: str):
+        # cohere 4.x streams events from chat(stream=True)
+        for token in self.profile.stream(message):
+            yield SimpleNamespace(event_type="text-generation", text=token)
+        yield SimpleNamespace(event_type="stream-end", text="")
+
+    def check_api_key(self):
+        return {"valid": True}
+
+
+class MockSerper:
+    """Stand-in for the Serper search API"""
+
+    def __init__(self, profile: MockProfile, results: int = 5):
+        self.profile = profile
+        self.results = results
+
+    def transport(self) -> httpx.MockTransport:
+        """HTTP transport answering Serper requests, so the real HTTP client path is exercised"""
+        async def handle(request: httpx.Request) -> httpx.Response:
+            try:
+                return httpx.Response(200, json=await self.search(json.loads(request.content)))
+            except MockProviderError as e:
+                return httpx.Response(e.status_code, json={"message": str(e)})
+        return httpx.MockTransport(handle)
+
+    async def search(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a Serper-shaped response after a simulated network delay"""
+        await asyncio.sleep(self.profile.sample_latency())
+        self.profile.maybe_fail()
+        query = payload.get("q", "")
+        slug = hashlib.md5(query.lower().encode()).hexdigest()[:8]
+        return {
+            "organic": [
+                {
+                    "title": f"Result {i + 1} for {query}",
+                    "snippet": f"Mock search snippet {i + 1} about {query}. " * 3,
+                    "link": f"https://example.com/{slug}/{i + 1}"
+                }
+                for i in range(min(payload.get("num", self.results), self.results))
+            ]
+        }
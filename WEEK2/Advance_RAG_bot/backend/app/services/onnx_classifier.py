@@ -0,0 +1,84 @@
+"""
+ONNX Runtime backend for the guardrail text classifiers.
+
+The Hugging Face model is exported to ONNX once, optionally quantized to int8 with
+dynamic quantization, and cached under settings.ONNX_MODEL_DIR. The result is wrapped
+in a regular transformers pipeline, so callers (batching, sliding windows) don't change.
+"""
+from typing import Any
+import os
+import logging
+import platform
+import importlib.util
+from config import settings
+
+# Probe without importing: optimum pulls in torch and transformers, which only load with a classifier
+ONNX_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("onnxruntime", "optimum"))
+
+logger = logging.getLogger(__name__)
+
+
+def _quantization_config():
+    """Dynamic int8 quantization targeting the configured instruction set"""
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    target = settings.ONNX_QUANTIZATION_TARGET
+    if target == "auto":
+        target = "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+    return getattr(AutoQuantizationConfig, target)(is_static=False, per_channel=False)
+
+
+def _session_options() -> Any:
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    # 0 lets ONNX Runtime pick; pin these when several workers share the cores
+    options.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = settings.ONNX_INTER_OP_THREADS
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+def export_model(model_name: str, quantize: bool = True) -> str:
+    """Export (and quantize) a model unless a cached copy exists; returns its directory"""
+    from transformers import AutoTokenizer
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+
+    export_dir = os.path.join(settings.ONNX_MODEL_DIR, model_name.replace("/", "__"))
+    quantized_dir = f"{export_dir}-int8"
+
+    if not os.path.exists(os.path.join(export_dir, "model.onnx")):
+        logger.info(f"Exporting {model_name} to ONNX in {export_dir}")
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        model.save_pretrained(export_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+
+    if not quantize:
+        return export_dir
+
+    if not os.path.exists(os.path.join(quantized_dir, "model_quantized.onnx")):
+        logger.info(f"Quantizing {model_name} to int8 in {quantized_dir}")
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        quantizer.quantize(save_dir=quantized_dir, quantization_config=_quantization_config())
+        AutoTokenizer.from_pretrained(export_dir).save_pretrained(quantized_dir)
+    return quantized_dir
+
+
+def build_onnx_classifier(model_name: str, quantize: bool = None) -> Any:
+    """A text-classification pipeline running the model on ONNX Runtime (CPU)"""
+    if not ONNX_AVAILABLE:
+        raise ImportError("optimum[onnxruntime] is not installed")
+    from transformers import AutoTokenizer, pipeline
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+
+    quantize = settings.ONNX_QUANTIZE if quantize is None else quantize
+    model_dir = export_model(model_name, quantize)
+    model = ORTModelForSequenceClassification.from_pretrained(
+        model_dir,
+        file_name="model_quantized.onnx" if quantize else "model.onnx",
+        session_options=_session_options(),
+        provider="CPUExecutionProvider"
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    return pipeline("text-classification", model=model, tokenizer=tokenizer)
@@ -0,0 +1,108 @@
+from typing import Any, AsyncIterator, Deque, Dict, List, Tuple
+from collections import deque
+import asyncio
+import logging
+import re
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class OutputBlockedError(Exception):
+    """A streamed answer window failed output moderation"""
+
+    def __init__(self, reason: str, offset: int):
+        self.reason = reason
+        self.offset = offset  # characters of the answer released before the flagged window
+        super().__init__(f"Response blocked by output moderation: {reason}")
+
+
+class OutputModerator:
+    """Moderate a streamed LLM answer window by window before any of it reaches the client.
+
+    Completed sentence-sized windows are scored on the guardrail thread pool (sharing the
+    guardrail batchers) while later text keeps streaming in. A window is released only
+    after its verdict comes back, in order, so unverified text is never sent and the delay
+    is about one window's scoring time, overlapped with generation of the next window.
+    A flagged window raises OutputBlockedError with the length of the text already released.
+    """
+
+    def __init__(self, guardrails):
+        self.guardrails = guardrails
+        self.min_window_chars = settings.OUTPUT_MODERATION_MIN_WINDOW_CHARS
+        self.max_window_chars = settings.OUTPUT_MODERATION_MAX_WINDOW_CHARS
+        self.windows_checked = 0
+        self.streams_blocked = 0
+        self.logger = logging.getLogger(__name__)
+
+    def _split_windows(self, buffer: str) -> Tuple[List[str], str]:
+        """Cut complete windows off the front of the buffer, returning them and the remainder"""
+        windows = []
+        while True:
+            cut = None
+            for match in _SENTENCE_END.finditer(buffer):
+                if match.end() >= self.min_window_chars:
+                    cut = match.end()
+                    break
+            if cut is None and len(buffer) >= self.max_window_chars:
+                # No sentence end in sight: split at the last space so words stay whole
+                cut = buffer.rfind(" ", 0, self.max_window_chars) + 1 or self.max_window_chars
+            if cut is None:
+                return windows, buffer
+            windows.append(buffer[:cut])
+            buffer = buffer[cut:]
+
+    async def _release(self, pending: Deque[Tuple[int, str, asyncio.Task]], wait: bool) -> AsyncIterator[str]:
+        """Yield verified windows in order; without `wait`, stop at the first verdict still outstanding"""
+        while pending and (wait or pending[0][2].done()):
+            offset, window, task = pending.popleft()
+            verdict = await task
+            self.windows_checked += 1
+            if not verdict["safe"]:
+                self.streams_blocked += 1
+                self.logger.warning(f"Output moderation blocked a stream at {offset} chars: {verdict['reason']}")
+                raise OutputBlockedError(verdict["reason"], offset)
+            yield window
+
+    def _score(self, window: str) -> asyncio.Task:
+        return asyncio.create_task(self.guardrails.run(self.guardrails.check_output, window))
+
+    async def moderate(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Yield the streamed text as verified windows"""
+        if not settings.OUTPUT_MODERATION_ENABLED:
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        pending: Deque[Tuple[int, str, asyncio.Task]] = deque()
+        buffer = ""
+        offset = 0
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                windows, buffer = self._split_windows(buffer)
+                for window in windows:
+                    pending.append((offset, window, self._score(window)))
+                    offset += len(window)
+                async for window in self._release(pending, wait=False):
+                    yield window
+
+            if buffer.strip():
+                pending.append((offset, buffer, self._score(buffer)))
+            async for window in self._release(pending, wait=True):
+                yield window
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.OUTPUT_MODERATION_ENABLED,
+            "windows_checked": self.windows_checked,
+            "streams_blocked": self.streams_blocked
+        }
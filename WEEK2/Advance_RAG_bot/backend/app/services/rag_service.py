@@ -1,13 +1,15 @@
 from typing import List, Dict, Any, Optional
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import os
 import json
 import logging
 import pickle
 import asyncio
+import time
 from config import settings
+from services.ttl_cache import TTLCache
+from services.embeddings import get_encoder
 
 # Try to import ChromaDB, but make it optional
 try:
@@ -19,9 +21,14 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
 class BaseRAG:
     def __init__(self):
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        # Shared with the relevance gate, so a question is embedded once per request
+        self.encoder = get_encoder()
         self.vector_store_path = settings.VECTOR_STORE_PATH
         self.index = None
         self.documents = []
@@ -72,15 +79,16 @@ class BaseRAG:
         except Exception as e:
             logger.error(f"Failed to save vector store: {e}")
         
-    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+    def search(self, query: str, k: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """Enhanced semantic search with better ranking"""
         if not self.documents or self.index is None:
             logger.warning("No documents or index available for search")
             return []
             
         try:
-            # Encode query
-            query_embedding = self.encoder.encode([query])
+            # Encode query unless the caller already has its embedding
+            if query_embedding is None:
+                query_embedding = self.encoder.encode_query(query)
             
             # Search with higher k to get more candidates
             search_k = min(k * 2, self.index.ntotal)
@@ -88,28 +96,37 @@ class BaseRAG:
             
             results = []
             for i, idx in enumerate(indices[0]):
-                if idx < len(self.document_metadata):
+                if 0 <= idx < len(self.document_metadata):
                     metadata = self.document_metadata[idx]
                     score = float(distances[0][i])
+                    similarity = self._similarity(score)
                     
                     # Enhanced result with metadata
                     result = {
                         "content": self.documents[idx] if idx < len(self.documents) else "",
                         "score": score,
+                        "similarity": similarity,
                         "type": "semantic",
                         "source": "document",
                         "metadata": metadata,
-                        "relevance": "high" if score > 0.7 else "medium" if score > 0.5 else "low"
+                        "index_id": int(idx),
+                        "relevance": "high" if similarity > 0.7 else "medium" if similarity > 0.5 else "low"
                     }
                     results.append(result)
             
-            # Sort by score and return top k
-            results.sort(key=lambda x: x["score"], reverse=True)
+            # Most similar first; for an L2 index that is the smallest distance
+            results.sort(key=lambda x: x["similarity"], reverse=True)
             return results[:k]
             
         except Exception as e:
             logger.error(f"Semantic search error: {e}")
             return []
+    
+    def _similarity(self, score: float) -> float:
+        """Cosine similarity from a FAISS score: inner product as is, squared L2 distance of unit vectors converted"""
+        if getattr(self.index, "metric_type", faiss.METRIC_L2) == faiss.METRIC_INNER_PRODUCT:
+            return score
+        return 1.0 - score / 2.0
 
 class KnowledgeGraphRAG(BaseRAG):
     def __init__(self):
@@ -171,68 +188,110 @@ class HybridRAG(BaseRAG):
     def __init__(self, search_service):
         super().__init__()
         self.search_service = search_service
+        # Web result embeddings keyed by (URL, text) so repeat results are not re-encoded
+        self.web_embedding_cache = TTLCache(
+            maxsize=settings.HYBRID_EMBEDDING_CACHE_SIZE,
+            ttl=settings.SEARCH_CACHE_TTL + settings.SEARCH_CACHE_STALE_TTL
+        )
         self.logger = logging.getLogger(__name__)
     
     async def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
-        """Enhanced hybrid search combining semantic and internet search with intelligent ranking"""
+        """Hybrid search combining semantic and internet results ranked by cosine similarity to the query"""
         self.logger.info(f"Performing hybrid search for: {query}")
+        started = time.monotonic()
         
-        # Get semantic results from documents
-        semantic_results = super().search(query, k)
-        
-        # Get internet search results
-        internet_results = await self.search_service.search(query)
+        # Run local semantic search (off the event loop) and internet search concurrently
+        internet_task = asyncio.ensure_future(self.search_service.search(query))
+        semantic_task = asyncio.ensure_future(asyncio.to_thread(self._encode_and_search, query, k * 2))
         
-        # Enhanced ranking algorithm
-        combined_results = []
+        # Local results are always awaited; the web branch only gets what is left of the budget
+        try:
+            query_embedding, semantic_results = await semantic_task
+        except BaseException:
+            internet_task.cancel()
+            raise
+        remaining = settings.HYBRID_SEARCH_DEADLINE - (time.monotonic() - started)
+        try:
+            internet_results = await asyncio.wait_for(internet_task, timeout=max(remaining, 0))
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Internet search missed the {settings.HYBRID_SEARCH_DEADLINE:.1f}s hybrid deadline - using document results only")
+            internet_results = []
+        except Exception as e:
+            self.logger.warning(f"Internet search failed during hybrid search: {e}")
+            internet_results = []
         
-        # Add semantic results with higher weight
         for result in semantic_results:
             result["search_type"] = "semantic"
-            result["weight"] = result.get("score", 0) * 1.2  # Boost semantic results
-            combined_results.append(result)
-        
-        # Add internet results with adjusted weight
         for result in internet_results:
             result["search_type"] = "internet"
-            result["weight"] = 0.8  # Base weight for internet results
-            combined_results.append(result)
-        
-        # Intelligent ranking based on multiple factors
-        def ranking_score(result):
-            base_score = result.get("weight", 0)
-            
-            # Boost for high relevance
-            if result.get("relevance") == "high":
-                base_score *= 1.3
-            elif result.get("relevance") == "medium":
-                base_score *= 1.1
-            
-            # Boost for semantic results (document context)
-            if result.get("search_type") == "semantic":
-                base_score *= 1.2
-            
-            # Boost for recent internet results
-            if result.get("search_type") == "internet" and "snippet" in result:
-                snippet_length = len(result.get("snippet", ""))
-                if snippet_length > 100:  # Longer snippets often more informative
-                    base_score *= 1.1
-            
-            return base_score
-        
-        # Sort by ranking score
-        ranked_results = sorted(combined_results, key=ranking_score, reverse=True)
+        combined_results = semantic_results + internet_results
         
-        self.logger.info(f"Hybrid search returned {len(ranked_results)} total results "
-                        f"({len(semantic_results)} semantic, {len(internet_results)} internet)")
+        # Score every candidate in the same embedding space (one batched encoder call)
+        await asyncio.to_thread(self._score_results, query_embedding, combined_results)
+        ranked_results = sorted(combined_results, key=lambda r: r["final_score"], reverse=True)
         
-        # Return top k results with metadata
-        top_results = ranked_results[:k]
+        # Drop weak matches so fewer, better sources reach the LLM
+        top_results = [r for r in ranked_results if r["final_score"] >= settings.HYBRID_MIN_SCORE][:k]
         for i, result in enumerate(top_results):
             result["rank"] = i + 1
-            result["final_score"] = ranking_score(result)
         
+        self.logger.info(f"Hybrid search kept {len(top_results)} of {len(ranked_results)} results "
+                        f"({len(semantic_results)} semantic, {len(internet_results)} internet)")
         return top_results
+    
+    def _encode_and_search(self, query: str, k: int):
+        query_embedding = self.encoder.encode_query(query)
+        return query_embedding[0], BaseRAG.search(self, query, k, query_embedding=query_embedding)
+    
+    def _score_results(self, query_embedding: np.ndarray, results: List[Dict[str, Any]]):
+        """Set final_score to the cosine similarity between the query and each result"""
+        if not results:
+            return
+        query_vector = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        vectors: List[Optional[np.ndarray]] = [None] * len(results)
+        pending = []  # (position, text, cache key) still to be encoded
+        
+        for i, result in enumerate(results):
+            if result["search_type"] == "semantic":
+                vectors[i] = self._reconstruct_vector(result.get("index_id"), len(query_vector))
+                if vectors[i] is None:
+                    pending.append((i, result.get("content", ""), None))
+            else:
+                text = f"{result.get('title', '')}. {result.get('snippet', '')}"
+                cache_key = (result.get("link", ""), text)
+                entry = self.web_embedding_cache.get(cache_key)
+                if entry is not None:
+                    vectors[i] = entry.value
+                else:
+                    pending.append((i, text, cache_key))
+        
+        if pending:
+            encoded = self.encoder.encode(
+                [text for _, text, _ in pending],
+                batch_size=len(pending),
+                normalize_embeddings=True
+            )
+            for (i, _, cache_key), vector in zip(pending, encoded):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                if cache_key is not None:
+                    self.web_embedding_cache.set(cache_key, vectors[i])
+        
+        for result, vector in zip(results, vectors):
+            similarity = float(np.dot(query_vector, vector))
+            result["final_score"] = similarity
+            result["relevance"] = "high" if similarity > 0.5 else "medium" if similarity > 0.3 else "low"
+    
+    def _reconstruct_vector(self, index_id: Optional[int], dim: int) -> Optional[np.ndarray]:
+        """Read a stored chunk embedding back from the FAISS index, if the index supports it"""
+        if index_id is None or self.index is None:
+            return None
+        try:
+            vector = self.index.reconstruct(int(index_id))
+            if len(vector) != dim:
+                return None
+            return _normalize(np.asarray(vector, dtype=np.float32))
+        except Exception:
+            return None
 
 class RAGFactory:
     @staticmethod
@@ -0,0 +1,188 @@
+from typing import Any, Dict, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderBusyError(Exception):
+    """Raised when a request cannot get a provider slot before its queue deadline"""
+
+
+class ProviderError(Exception):
+    """A provider call failed; status_code is the provider's HTTP status when it reported one"""
+
+    def __init__(self, provider: str, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(f"{provider} API error: {message}")
+
+    @property
+    def rate_limited(self) -> bool:
+        return self.status_code == 429
+
+    @classmethod
+    def from_exception(cls, provider: str, error: Exception) -> "ProviderError":
+        """Wrap an SDK exception, reading the HTTP status and Retry-After header where the SDK exposes them"""
+        response = getattr(error, "response", None)
+        status_code = (
+            getattr(error, "status_code", None)
+            or getattr(error, "http_status", None)  # cohere 4.x CohereAPIError
+            or getattr(response, "status_code", None)
+        )
+        if status_code is None and isinstance(getattr(error, "code", None), int):
+            status_code = error.code  # google.api_core errors
+        headers = getattr(error, "headers", None) or getattr(response, "headers", None)
+        return cls(provider, str(error), status_code if isinstance(status_code, int) else None, _retry_after(headers))
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    """Seconds from a Retry-After header; plain dicts are matched case-insensitively"""
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after")
+        if value is None:
+            value = next((v for k, v in headers.items() if str(k).lower() == "retry-after"), None)
+        return float(value)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second with bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_available(self) -> float:
+        """Seconds until one token can be taken (0 when available now)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class ProviderLimiter:
+    """Rate limit and concurrency cap for one provider/model with a FIFO wait queue"""
+
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # asyncio.Lock wakes waiters in arrival order, which keeps the queue fair
+        self._queue_lock = asyncio.Lock()
+
+        self.queued = 0
+        self.in_flight = 0
+        self.total_requests = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    async def _acquire(self):
+        async with self._queue_lock:
+            await self._semaphore.acquire()
+            try:
+                delay = self.bucket.time_until_available()
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = self.bucket.time_until_available()
+                self.bucket.consume()
+            except BaseException:
+                self._semaphore.release()
+                raise
+
+    @asynccontextmanager
+    async def slot(self, timeout: float):
+        """Wait in line for a provider slot, raising ProviderBusyError after `timeout` seconds"""
+        start = time.monotonic()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"[{self.name}] Gave up waiting for a provider slot after {timeout:.1f}s")
+            raise ProviderBusyError(f"{self.name} is busy, please retry shortly")
+        finally:
+            self.queued -= 1
+
+        wait = time.monotonic() - start
+        self.total_requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.last_wait = wait
+        if wait > 1.0:
+            logger.info(f"[{self.name}] Request waited {wait:.2f}s for a provider slot")
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue and wait-time statistics"""
+        return {
+            "rate_per_second": self.bucket.rate,
+            "burst": self.bucket.capacity,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "timeouts": self.timeouts,
+            "avg_wait_seconds": self.total_wait / self.total_requests if self.total_requests else 0.0,
+            "max_wait_seconds": self.max_wait,
+            "last_wait_seconds": self.last_wait
+        }
+
+
+class RateLimiterRegistry:
+    """Per provider/model limiters configured from settings.LLM_RATE_LIMITS"""
+
+    def __init__(self):
+        self.limiters: Dict[str, ProviderLimiter] = {}
+
+    def _get_config(self, llm_choice: str) -> Dict[str, float]:
+        provider = llm_choice.split(":", 1)[0]
+        limits = settings.LLM_RATE_LIMITS
+        return limits.get(llm_choice) or limits.get(provider) or limits.get("default", {})
+
+    def get(self, llm_choice: str) -> ProviderLimiter:
+        if llm_choice not in self.limiters:
+            config = self._get_config(llm_choice)
+            self.limiters[llm_choice] = ProviderLimiter(
+                llm_choice,
+                rate=config.get("rate", 0),
+                burst=config.get("burst", 1),
+                max_concurrency=config.get("max_concurrency", 4)
+            )
+        return self.limiters[llm_choice]
+
+    def slot(self, llm_choice: str):
+        """Acquire a slot for llm_choice using the configured queue deadline"""
+        return self.get(llm_choice).slot(settings.LLM_QUEUE_TIMEOUT)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: limiter.get_stats() for name, limiter in self.limiters.items()}
@@ -0,0 +1,270 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict, deque
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """Recent messages and running summary of one conversation"""
+
+    __slots__ = ("messages", "row_ids", "summary", "summarized_until", "context_embeddings", "last_access",
+                 "first_row_id", "last_row_id")
+
+    def __init__(self, max_messages: int):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.row_ids: deque = deque(maxlen=max_messages)  # persistent row of each cached message
+        self.summary: Optional[str] = None
+        self.summarized_until = 0.0  # timestamp of the newest message folded into `summary`
+        self.context_embeddings = None  # this worker's TurnIndex for semantic recall, built as turns arrive
+        self.last_access = time.monotonic()
+        self.first_row_id = 0  # oldest persistent row of the session; it changes only when the session is reset
+        self.last_row_id = 0  # newest persistent row already in `messages`
+
+
+class SQLiteSessionStore:
+    """Append-only message log in SQLite (WAL mode), shared by every worker process on the host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+                "created_at REAL NOT NULL, message TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "summarized_until REAL NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(summaries)")]
+            if "summarized_until" not in columns:
+                self._conn.execute("ALTER TABLE summaries ADD COLUMN summarized_until REAL NOT NULL DEFAULT 0")
+
+    def append(self, session_id: str, message: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messages (session_id, created_at, message) VALUES (?, ?, ?)",
+                (session_id, time.time(), json.dumps(message))
+            )
+
+    def first_id(self, session_id: str) -> int:
+        """Oldest row of a session, 0 when it has none"""
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(id) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] or 0
+
+    def get_messages(self, session_id: str, row_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Messages of a session by row id"""
+        if not row_ids:
+            return {}
+        placeholders = ", ".join("?" * len(row_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, message FROM messages WHERE session_id = ? AND id IN ({placeholders})",
+                (session_id, *row_ids)
+            ).fetchall()
+        return {row_id: json.loads(message) for row_id, message in rows}
+
+    def load(self, session_id: str, after_id: int, limit: int) -> Tuple[List[Tuple[int, Dict[str, Any]]], Optional[Tuple[str, float]]]:
+        """Up to `limit` newest messages after row `after_id`, oldest first, and the session summary with its watermark"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, message FROM messages WHERE session_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+                (session_id, after_id, limit)
+            ).fetchall()
+            summary = self._conn.execute(
+                "SELECT summary, summarized_until FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return [(row_id, json.loads(message)) for row_id, message in reversed(rows)], tuple(summary) if summary else None
+
+    def set_summary(self, session_id: str, summary: str, summarized_until: float):
+        """Store a summary unless another worker already stored one covering more of the conversation"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO summaries (session_id, summary, updated_at, summarized_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at, "
+                "summarized_until = excluded.summarized_until WHERE excluded.summarized_until > summaries.summarized_until",
+                (session_id, summary, time.time(), summarized_until)
+            )
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+
+    def session_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT session_id FROM messages")]
+
+    def prune(self, older_than_seconds: float) -> int:
+        """Drop sessions with no messages newer than the cutoff; returns how many messages were removed"""
+        cutoff = time.time() - older_than_seconds
+        with self._lock:
+            stale = "SELECT session_id FROM messages GROUP BY session_id HAVING MAX(created_at) < ?"
+            self._conn.execute(f"DELETE FROM summaries WHERE session_id IN ({stale})", (cutoff,))
+            removed = self._conn.execute(f"DELETE FROM messages WHERE session_id IN ({stale})", (cutoff,)).rowcount
+        return removed
+
+
+class SessionStore:
+    """Bounded in-memory LRU of sessions with idle eviction, optionally backed by SQLite.
+
+    At most `max_sessions` sessions stay in memory and any session idle for `idle_ttl`
+    seconds is dropped, so memory stays flat however many sessions have been served.
+    With a persistent store every write goes to SQLite first and each access pulls rows
+    other workers appended since, so all workers see the same conversation.
+    """
+
+    def __init__(self, max_messages: int, max_sessions: int, idle_ttl: float,
+                 persistent: Optional[SQLiteSessionStore] = None):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.persistent = persistent
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session.last_access <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+
+    def _refresh(self, session_id: str, session: Session) -> bool:
+        """Pull newer persistent rows into the cached session; returns whether any exist"""
+        # Rows are only ever deleted a whole session at a time, so a different oldest row means another
+        # worker cleared the session (and the user may have carried on since); start over from storage
+        first_row_id = self.persistent.first_id(session_id)
+        if session.first_row_id and first_row_id != session.first_row_id:
+            session.messages.clear()
+            session.row_ids.clear()
+            session.summary = None
+            session.summarized_until = 0.0
+            session.context_embeddings = None
+            session.last_row_id = 0
+        session.first_row_id = first_row_id
+        rows, summary = self.persistent.load(session_id, session.last_row_id, self.max_messages)
+        for row_id, message in rows:
+            session.messages.append(message)
+            session.row_ids.append(row_id)
+            session.last_row_id = row_id
+        if summary is not None:
+            session.summary, session.summarized_until = summary
+        return session.last_row_id > 0 or summary is not None
+
+    def get(self, session_id: str, create: bool = False) -> Optional[Session]:
+        """The session, loaded from the persistent store on a cache miss"""
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self.hits += 1
+                if self.persistent is not None:
+                    self._refresh(session_id, session)
+            else:
+                self.misses += 1
+                session = Session(self.max_messages)
+                if not (self.persistent is not None and self._refresh(session_id, session)) and not create:
+                    return None
+
+            session.last_access = time.monotonic()
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            if len(self._sessions) > self.max_sessions:
+                self._evict()
+            return session
+
+    def append(self, session_id: str, message: Dict[str, Any]) -> Session:
+        with self._lock:
+            if self.persistent is not None:
+                self.persistent.append(session_id, message)
+                return self.get(session_id, create=True)
+            session = self.get(session_id, create=True)
+            session.messages.append(message)
+            return session
+
+    def rows(self, session: Session) -> List[Tuple[Optional[int], Dict[str, Any]]]:
+        """Cached messages of a session with their persistent row ids (None without a persistent store)"""
+        with self._lock:
+            messages = list(session.messages)
+            row_ids = list(session.row_ids)
+        if len(row_ids) != len(messages):
+            row_ids = [None] * len(messages)
+        return list(zip(row_ids, messages))
+
+    def get_messages(self, session_id: str, row_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Messages of a session by persistent row id; empty without a persistent store"""
+        if self.persistent is None:
+            return {}
+        return self.persistent.get_messages(session_id, row_ids)
+
+    def set_summary(self, session_id: str, summary: str, summarized_until: float):
+        with self._lock:
+            if self.persistent is not None:
+                self.persistent.set_summary(session_id, summary, summarized_until)
+            session = self._sessions.get(session_id)
+            if session is not None and summarized_until > session.summarized_until:
+                session.summary = summary
+                session.summarized_until = summarized_until
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self.persistent is not None:
+                self.persistent.delete(session_id)
+
+    def session_ids(self) -> List[str]:
+        if self.persistent is not None:
+            return self.persistent.session_ids()
+        with self._lock:
+            self._evict()
+            return list(self._sessions.keys())
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite" if self.persistent is not None else "memory",
+            "cached_sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+
+def create_session_store(max_messages: int) -> SessionStore:
+    """Session store configured from settings"""
+    persistent = None
+    if settings.SESSION_STORE == "sqlite":
+        persistent = SQLiteSessionStore(settings.SESSION_DB_PATH)
+        if settings.SESSION_DB_RETENTION_DAYS > 0:
+            removed = persistent.prune(settings.SESSION_DB_RETENTION_DAYS * 86400)
+            if removed:
+                logger.info(f"Pruned {removed} messages from sessions idle over {settings.SESSION_DB_RETENTION_DAYS} days")
+    return SessionStore(
+        max_messages,
+        max_sessions=settings.SESSION_MAX_SESSIONS,
+        idle_ttl=settings.SESSION_IDLE_TTL,
+        persistent=persistent
+    )
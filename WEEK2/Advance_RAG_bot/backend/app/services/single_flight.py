@@ -0,0 +1,70 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import copy
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_key(*parts: Optional[Any]) -> str:
+    """Build a stable key from request parts (case-folded, whitespace collapsed)"""
+    normalized = []
+    for part in parts:
+        if part is None:
+            normalized.append("")
+        elif isinstance(part, (list, tuple)):
+            normalized.append(normalize_key(*part))
+        elif isinstance(part, bytes):
+            normalized.append(hashlib.sha256(part).hexdigest())
+        else:
+            normalized.append(" ".join(str(part).lower().split()))
+    return hashlib.sha256("\x1f".join(normalized).encode()).hexdigest()
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one shared in-flight task"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.total_calls = 0
+        self.executed_calls = 0
+        self.coalesced_calls = 0
+        self.logger = logging.getLogger(__name__)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn once per key; concurrent callers with the same key share its result"""
+        self.total_calls += 1
+        task = self._inflight.get(key)
+
+        if task is None:
+            self.executed_calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+            # Shield so a cancelled caller does not cancel the work others wait on
+            return await asyncio.shield(task)
+
+        self.coalesced_calls += 1
+        self.logger.info(f"[{self.name}] Coalesced request onto in-flight call ({len(self._inflight)} in flight)")
+        result = await asyncio.shield(task)
+        # Followers get their own copy so callers can mutate results freely
+        return copy.deepcopy(result)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        """Drop a finished task and retrieve its exception so it is never left unobserved"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics"""
+        return {
+            "name": self.name,
+            "total_calls": self.total_calls,
+            "executed_calls": self.executed_calls,
+            "coalesced_calls": self.coalesced_calls,
+            "in_flight": len(self._inflight)
+        }
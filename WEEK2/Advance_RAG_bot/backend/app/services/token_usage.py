@@ -0,0 +1,109 @@
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+import logging
+import math
+from config import settings
+
+# Try to import tiktoken for local token counting, but make it optional
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+    logging.warning("tiktoken not available - estimating token counts from text length")
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Count tokens locally, used when a provider does not report usage"""
+    global _encoding
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE:
+        try:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            return len(_encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.warning(f"tiktoken counting failed, falling back to estimate: {e}")
+    # Roughly four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+def _empty_usage() -> Dict[str, Any]:
+    return {
+        "requests": 0,
+        "estimated_requests": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "max_prompt_tokens": 0,
+        "estimated_cost_usd": 0.0
+    }
+
+
+class TokenUsageTracker:
+    """Aggregate prompt/completion token usage per session, model and endpoint"""
+
+    def __init__(self, max_sessions: int = None):
+        self.max_sessions = max_sessions or settings.TOKEN_USAGE_MAX_SESSIONS
+        self.totals = _empty_usage()
+        self.by_model: Dict[str, Dict[str, Any]] = {}
+        self.by_endpoint: Dict[str, Dict[str, Any]] = {}
+        # Least recently active sessions are dropped once max_sessions is reached
+        self.by_session: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _estimate_cost(self, llm_choice: str, prompt_tokens: int, completion_tokens: int) -> float:
+        provider = llm_choice.split(":", 1)[0]
+        prices = settings.LLM_TOKEN_PRICES.get(llm_choice) or settings.LLM_TOKEN_PRICES.get(provider)
+        if not prices:
+            return 0.0
+        return (prompt_tokens * prices.get("prompt", 0.0) + completion_tokens * prices.get("completion", 0.0)) / 1_000_000
+
+    def record(self, llm_choice: str, prompt_tokens: int, completion_tokens: int,
+               session_id: Optional[str] = None, endpoint: str = "chat", estimated: bool = False):
+        """Record token usage of one provider call"""
+        cost = self._estimate_cost(llm_choice, prompt_tokens, completion_tokens)
+
+        if session_id:
+            if session_id not in self.by_session:
+                self.by_session[session_id] = _empty_usage()
+            self.by_session.move_to_end(session_id)
+            while len(self.by_session) > self.max_sessions:
+                self.by_session.popitem(last=False)
+
+        buckets = [
+            self.totals,
+            self.by_model.setdefault(llm_choice, _empty_usage()),
+            self.by_endpoint.setdefault(endpoint, _empty_usage())
+        ]
+        if session_id:
+            buckets.append(self.by_session[session_id])
+
+        for usage in buckets:
+            usage["requests"] += 1
+            usage["estimated_requests"] += 1 if estimated else 0
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+            usage["total_tokens"] += prompt_tokens + completion_tokens
+            usage["max_prompt_tokens"] = max(usage["max_prompt_tokens"], prompt_tokens)
+            usage["estimated_cost_usd"] += cost
+
+        logger.info(f"Token usage - {llm_choice} [{endpoint}]: prompt={prompt_tokens}, "
+                    f"completion={completion_tokens}{' (estimated)' if estimated else ''}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get aggregated usage across all sessions"""
+        return {
+            "totals": self.totals,
+            "by_model": self.by_model,
+            "by_endpoint": self.by_endpoint,
+            "tracked_sessions": len(self.by_session)
+        }
+
+    def get_session_stats(self, session_id: str) -> Dict[str, Any]:
+        """Get aggregated usage for one session"""
+        return self.by_session.get(session_id, _empty_usage())
@@ -0,0 +1,84 @@
+from typing import Any, Dict, Hashable, NamedTuple, Optional
+from collections import OrderedDict
+import threading
+import time
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    age: float
+    hits: int
+    stale: bool
+
+
+class TTLCache:
+    """Thread-safe bounded LRU cache whose entries expire after a TTL.
+
+    Expired entries can still be served for `stale_ttl` more seconds when the caller
+    asks for them, so it can refresh in the background (stale-while-revalidate).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float = 0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, allow_stale: bool = False) -> Optional[CacheEntry]:
+        """Look up a key, returning None on a miss"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            value, stored_at, hits = item
+            age = time.monotonic() - stored_at
+            stale = age > self.ttl
+            if stale and (not allow_stale or age > self.ttl + self.stale_ttl):
+                if age > self.ttl + self.stale_ttl:
+                    del self._data[key]
+                self.misses += 1
+                return None
+
+            item[2] = hits + 1
+            self._data.move_to_end(key)
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return CacheEntry(value, age, hits + 1, stale)
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            previous = self._data.pop(key, None)
+            # Keep the popularity count across refreshes
+            self._data[key] = [value, time.monotonic(), previous[2] if previous else 0]
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable = None):
+        """Drop one key, or everything when no key is given"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0
+        }
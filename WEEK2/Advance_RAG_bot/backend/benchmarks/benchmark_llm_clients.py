@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: per-request Gemini client construction vs the pooled client objects in LLMService
+
+Usage:
+    python benchmarks/benchmark_llm_clients.py            # offline, construction overhead only
+    python benchmarks/benchmark_llm_clients.py --live     # also time real cold vs warm requests
+"""
+import sys
+import os
+import time
+import argparse
+import statistics
+
+# Add the app directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import google.generativeai as genai
+from config import settings
+
+
+def time_calls(fn, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings: list):
+    print(f"{label:<32} mean={statistics.mean(timings):8.3f} ms  "
+          f"p50={statistics.median(timings):8.3f} ms  max={max(timings):8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=settings.GEMINI_MODELS[0])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--live", action="store_true", help="Send real requests (needs GEMINI_API_KEY)")
+    args = parser.parse_args()
+
+    genai.configure(api_key=settings.GEMINI_API_KEY or "offline-benchmark")
+    pool = {args.model: genai.GenerativeModel(args.model)}
+
+    print(f"Model: {args.model}, iterations: {args.iterations}")
+    report("GenerativeModel per request", time_calls(lambda: genai.GenerativeModel(args.model), args.iterations))
+    report("Pooled model lookup", time_calls(lambda: pool[args.model], args.iterations))
+
+    if args.live:
+        if not settings.GEMINI_API_KEY:
+            print("GEMINI_API_KEY not configured - skipping live benchmark")
+            return
+        prompt = "Reply with the single word: ok"
+        live_iterations = 5
+        report("Live: new model each request",
+               time_calls(lambda: genai.GenerativeModel(args.model).generate_content(prompt), live_iterations))
+        pooled = pool[args.model]
+        pooled.count_tokens("warm up")
+        report("Live: pooled, warmed model",
+               time_calls(lambda: pooled.generate_content(prompt), live_iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark: toxic-bert on PyTorch vs ONNX Runtime (int8-quantized by default)
+
+Reports single-message latency, batched throughput and how often the two backends
+agree on the toxic / not-toxic decision at settings.TOXICITY_THRESHOLD.
+Needs optimum[onnxruntime]; the first run exports and quantizes the model into ONNX_MODEL_DIR.
+
+Usage:
+    python benchmarks/benchmark_toxicity_onnx.py
+    python benchmarks/benchmark_toxicity_onnx.py --file messages.txt --threads 4 --batch-size 16
+    python benchmarks/benchmark_toxicity_onnx.py --no-quantize      # fp32 ONNX for comparison
+"""
+import sys
+import os
+import time
+import argparse
+import statistics
+
+# Add the app directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from config import settings
+
+TOXIC_LABELS = ['toxic', 'obscene', 'insult', 'threat', 'identity_hate']
+
+SAMPLE_MESSAGES = [
+    "What are the key findings in the quarterly report?",
+    "Can you summarize the contract termination clause?",
+    "How do I configure the database connection pool?",
+    "Explain the difference between the two treatment options.",
+    "Thanks, that was really helpful!",
+    "Which sections of the document mention revenue growth?",
+    "Please list the action items from the meeting notes.",
+    "What does the error message in the log file mean?",
+    "You are an idiot and your answers are garbage.",
+    "Shut up, nobody asked for your stupid opinion.",
+    "This is the dumbest tool I have ever used, you moron.",
+    "I hate you and everything you say.",
+    "Why is this answer so wrong? Try again please.",
+    "The patient reported mild symptoms after the second dose.",
+    "Compare the loan terms offered by both banks.",
+    "Write a short summary of the attached research paper.",
+]
+
+
+def toxic_score(results) -> float:
+    return max([r['score'] for r in results if r['label'] in TOXIC_LABELS], default=0.0)
+
+
+def time_single(classifier, messages, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        for message in messages:
+            start = time.perf_counter()
+            classifier(message, truncation=True, top_k=None)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_batched(classifier, messages, batch_size: int, iterations: int) -> float:
+    """Messages per second when classified in batches"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for i in range(0, len(messages), batch_size):
+            batch = messages[i:i + batch_size]
+            classifier(batch, batch_size=len(batch), truncation=True, top_k=None)
+    return iterations * len(messages) / (time.perf_counter() - start)
+
+
+def report(name: str, timings: list, throughput: float):
+    timings = sorted(timings)
+    print(f"{name:<10} p50={statistics.median(timings):7.2f}ms "
+          f"p95={timings[int(len(timings) * 0.95) - 1]:7.2f}ms "
+          f"mean={statistics.mean(timings):7.2f}ms  batched={throughput:7.1f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", help="Newline-delimited messages to use instead of the built-in sample")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=settings.GUARDRAIL_BATCH_MAX_SIZE)
+    parser.add_argument("--threads", type=int, default=None, help="ONNX intra-op threads (and torch threads)")
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+
+    from transformers import pipeline
+    import torch
+    from services.onnx_classifier import ONNX_AVAILABLE, build_onnx_classifier
+
+    if not ONNX_AVAILABLE:
+        sys.exit("optimum[onnxruntime] is not installed")
+
+    if args.file:
+        with open(args.file) as f:
+            messages = [line.strip() for line in f if line.strip()]
+    else:
+        messages = SAMPLE_MESSAGES
+    if args.threads:
+        settings.ONNX_INTRA_OP_THREADS = args.threads
+        torch.set_num_threads(args.threads)
+
+    print(f"Loading {settings.TOXICITY_MODEL} on PyTorch (CPU)...")
+    pytorch_classifier = pipeline("text-classification", model=settings.TOXICITY_MODEL,
+                                  tokenizer=settings.TOXICITY_MODEL, device=-1)
+    print(f"Loading {settings.TOXICITY_MODEL} on ONNX Runtime ({'fp32' if args.no_quantize else 'int8'})...")
+    onnx_classifier = build_onnx_classifier(settings.TOXICITY_MODEL, quantize=not args.no_quantize)
+
+    # Warm both before timing
+    for classifier in (pytorch_classifier, onnx_classifier):
+        classifier(messages[:2], truncation=True, top_k=None)
+
+    print(f"\n{len(messages)} messages x {args.iterations} iterations, batch size {args.batch_size}")
+    for name, classifier in (("pytorch", pytorch_classifier), ("onnx", onnx_classifier)):
+        report(name, time_single(classifier, messages, args.iterations),
+               time_batched(classifier, messages, args.batch_size, args.iterations))
+
+    threshold = settings.TOXICITY_THRESHOLD
+    pytorch_scores = [toxic_score(r) for r in pytorch_classifier(messages, truncation=True, top_k=None)]
+    onnx_scores = [toxic_score(r) for r in onnx_classifier(messages, truncation=True, top_k=None)]
+    agreements = sum((a > threshold) == (b > threshold) for a, b in zip(pytorch_scores, onnx_scores))
+    differences = [abs(a - b) for a, b in zip(pytorch_scores, onnx_scores)]
+
+    print(f"\nAgreement at threshold {threshold}: {agreements}/{len(messages)} ({100 * agreements / len(messages):.1f}%)")
+    print(f"Score difference: mean={statistics.mean(differences):.4f} max={max(differences):.4f}")
+    for message, a, b in zip(messages, pytorch_scores, onnx_scores):
+        if (a > threshold) != (b > threshold):
+            print(f"  disagree: pytorch={a:.3f} onnx={b:.3f}  {message[:70]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Load test for the /chat endpoint.
+
+Start the backend against the in-process mock providers so no provider quota is used:
+    MOCK_PROVIDERS=true MOCK_LATENCY_MS=300 uvicorn main:app --port 8000    (from backend/app)
+
+Then run:
+    python benchmarks/load_test_chat.py --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+async def run_load_test(base_url: str, total: int, concurrency: int, distinct: int, timeout: float):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    status_counts = {}
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        async def one_request(i: int):
+            payload = {
+                "message": f"What are the key points of topic {i % distinct}?",
+                "session_id": f"load-{uuid.uuid4().hex[:8]}"
+            }
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/chat", json=payload)
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append((time.perf_counter() - start) * 1000)
+                status_counts[status] = status_counts.get(status, 0) + 1
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(*[one_request(i) for i in range(total)])
+        wall = time.perf_counter() - wall_start
+
+        metrics = {}
+        for name in ("single-flight", "rate-limits", "tokens"):
+            try:
+                metrics[name] = (await client.get(f"/metrics/{name}")).json()
+            except httpx.HTTPError:
+                pass
+
+    latencies.sort()
+    print(f"Requests: {total}, concurrency: {concurrency}, distinct questions: {distinct}")
+    print(f"Wall time: {wall:.2f}s, throughput: {total / wall:.1f} req/s")
+    print(f"Latency ms: p50={statistics.median(latencies):.0f} "
+          f"p90={latencies[int(len(latencies) * 0.9) - 1]:.0f} "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1]:.0f} max={latencies[-1]:.0f}")
+    print(f"Status codes: {status_counts}")
+    for name, value in metrics.items():
+        print(f"{name}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--distinct", type=int, default=20, help="Number of distinct questions to cycle through")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    asyncio.run(run_load_test(args.url, args.requests, args.concurrency, args.distinct, args.timeout))
+
+
+if __name__ == "__main__":
+    main()